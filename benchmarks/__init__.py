@@ -0,0 +1 @@
+'''Benchmarks for QRN, run with: python -m benchmarks.run'''
@@ -0,0 +1,61 @@
+'''Measure template compile throughput on large generated templates.
+
+    PYTHONPATH=src python -m benchmarks.compile --blocks 2000
+
+Run it from the top of the tree, so it measures the QRN source there.
+'''
+
+import argparse
+import time
+import qrn.epy as epy
+import qrn.paml as paml
+
+PAML_BLOCK = '''.row.block{n}
+  %ul.menu#menu{n}
+    %li.menu
+      %a{{"href": "/index.html", "title": "Contents {n}"}} Contents
+    %li.menu
+      %a{{"href": "/page{n}.html"}} Page {n}
+  - for i in range(3):
+    %p.item= i
+  - if page.get('title'):
+    %h2.title= page['title']
+  %p.text Some plain text with an \\{{escaped brace\\}} in it.
+'''
+
+EPY_BLOCK = '''<div class="row block{n}">
+  <h2><%= page['title'] %></h2>
+  <%! for i in range(3): %>
+    <p class="item"><%= i %></p>
+  <%! end %>
+  <p>Some plain text, <%% escaped %%>.</p>
+</div>
+'''
+
+def time_compile(name, compile_f, text, repeat):
+    '''Compile text repeat times, printing the best throughput.'''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compile_f(text, name)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    kbytes = len(text) / 1024
+    lines = text.count('\n')
+    print(f'{name:<5} {kbytes:9.0f} KB {lines:8d} lines {best:8.3f}s '
+          f'{kbytes / best:9.0f} KB/s {lines / best:9.0f} lines/s')
+    return best
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark template compilation.')
+    parser.add_argument('--blocks', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    paml_text = ''.join(PAML_BLOCK.format(n=n) for n in range(args.blocks))
+    epy_text = ''.join(EPY_BLOCK.format(n=n) for n in range(args.blocks))
+    time_compile('paml', paml.template_from_text, paml_text, args.repeat)
+    time_compile('epy', epy.template_from_text, epy_text, args.repeat)
+
+if __name__ == '__main__':
+    main()
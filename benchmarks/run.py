@@ -0,0 +1,159 @@
+'''Time QRN builds of a synthetic site.
+
+    python -m benchmarks.run --articles 1000 --jobs 4
+
+Each scenario (cold build, no-op rebuild, single article edit, single
+layout edit) runs in a fresh Python process against the QRN source in
+this tree. By default the stub pandoc and sass in benchmarks/stubs are
+put first on the PATH, so runs are hermetic. Results are saved under
+benchmarks/results and compared with the last run with the same settings.'''
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import benchmarks.synth as synth
+
+HERE = Path(__file__).resolve().parent
+SRC = Path(HERE.parent, 'src')
+RESULTS = Path(HERE, 'results')
+
+SCENARIOS = ['cold', 'noop', 'edit_article', 'edit_layout']
+
+CHILD = '''
+import json, logging, sys, time
+logging.basicConfig(level=logging.WARNING)
+from qrn.qrn import build_indices, build_site
+start = time.perf_counter()
+site = build_indices()
+site.update(title='Synthetic', subtitle='A benchmark site', url='http://example.com')
+ok = build_site(site, jobs={jobs}, md_batch_size={md_batch_size})
+print()
+print(json.dumps({{'seconds': time.perf_counter() - start, 'ok': ok}}))
+'''
+
+def build(site_dir, args):
+    '''Build the site in a new process, returning the seconds it took.'''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([str(SRC), env.get('PYTHONPATH', '')])
+    if not args.real_tools:
+        env['PATH'] = os.pathsep.join([str(Path(HERE, 'stubs')), env['PATH']])
+    Path(site_dir, 'build').mkdir(exist_ok=True)
+    code = CHILD.format(jobs=args.jobs, md_batch_size=args.md_batch_size)
+    result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=site_dir, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr, file=sys.stderr)
+        raise Exception('Benchmark build failed')
+    data = json.loads(result.stdout.strip().split('\n')[-1])
+    if not data['ok']:
+        raise Exception('Benchmark build reported failure')
+    return data['seconds']
+
+def run_once(site_dir, args):
+    '''Run each of the scenarios once, returning the times.'''
+    synth.generate(site_dir,
+            articles=args.articles,
+            layouts=args.layouts,
+            stylesheets=args.stylesheets,
+            categories=args.categories,
+            paragraphs=args.paragraphs)
+    times = {}
+    times['cold'] = build(site_dir, args)
+    times['noop'] = build(site_dir, args)
+    synth.edit_article(site_dir)
+    times['edit_article'] = build(site_dir, args)
+    synth.edit_layout(site_dir)
+    times['edit_layout'] = build(site_dir, args)
+    return times
+
+def settings(args):
+    return {
+            'articles': args.articles,
+            'layouts': args.layouts,
+            'stylesheets': args.stylesheets,
+            'categories': args.categories,
+            'paragraphs': args.paragraphs,
+            'jobs': args.jobs,
+            'md_batch_size': args.md_batch_size,
+            'real_tools': args.real_tools}
+
+def previous_results(config):
+    '''Return the most recent saved results with the same settings, or None.'''
+    if not RESULTS.is_dir():
+        return None
+    for path in sorted(RESULTS.glob('*.json'), reverse=True):
+        with open(path) as f:
+            data = json.load(f)
+        if data['settings'] == config:
+            return data
+    return None
+
+def report(times, previous):
+    print(f'{"scenario":<14} {"seconds":>9} {"previous":>9} {"ratio":>7}')
+    for name in SCENARIOS:
+        line = f'{name:<14} {times[name]:9.3f}'
+        if previous:
+            before = previous['results'][name]
+            line += f' {before:9.3f} {times[name] / before:7.2f}'
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark QRN on a synthetic site.')
+    parser.add_argument('--articles', type=int, default=500)
+    parser.add_argument('--layouts', type=int, default=4)
+    parser.add_argument('--stylesheets', type=int, default=4)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--paragraphs', type=int, default=12)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--md-batch-size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='Keep the best of this many runs.')
+    parser.add_argument('--real-tools', action='store_true', help='Use the real pandoc and sass.')
+    parser.add_argument('--dir',
+            help='Where to generate the site, default a temp dir. Must be empty or an earlier generated site.')
+    parser.add_argument('--compare', help='Results file to compare with.')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(argv)
+
+    site_dir = Path(args.dir or tempfile.mkdtemp(prefix='qrn-bench-'))
+    best = {}
+    try:
+        for i in range(args.repeat):
+            times = run_once(site_dir, args)
+            for name in SCENARIOS:
+                best[name] = min(best.get(name, times[name]), times[name])
+    finally:
+        if not args.dir:
+            shutil.rmtree(site_dir, ignore_errors=True)
+
+    config = settings(args)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    else:
+        previous = previous_results(config)
+    report(best, previous)
+
+    if not args.no_save:
+        RESULTS.mkdir(exist_ok=True)
+        now = datetime.datetime.now()
+        data = {
+                'date': now.isoformat(),
+                'python': platform.python_version(),
+                'settings': config,
+                'results': best}
+        path = Path(RESULTS, now.strftime('%Y%m%d-%H%M%S.json'))
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+        print('Saved', path)
+
+if __name__ == '__main__':
+    main()
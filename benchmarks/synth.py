@@ -0,0 +1,249 @@
+'''Generate synthetic QRN sites for benchmarking, in the style of examples/walden.'''
+
+import datetime
+import random
+import shutil
+from pathlib import Path
+
+WORDS = '''the pond woods bean field house winter spring life village
+neighbors solitude economy reading sounds visitors laws animals farm
+ice snow wood fire loon fox squirrel railroad morning evening sun
+shore water deep still clear thought simple living men time'''.split()
+
+HEAD = '''---
+kind: partial
+---
+%head
+  %meta{"charset": "utf-8"}
+  %title= page.get('title', 'Synthetic QRN Site')
+  %meta{'name': 'viewport', 'content':  'width=device-width, initial-scale=1'}
+  %link{'rel': "stylesheet", 'href':  '/stylesheets/styles_0.css'}
+'''
+
+MASTHEAD = '''---
+kind: partial
+---
+%h1.logo Synthetic
+%h2.author A Benchmark Site
+= include('_menu.haml')
+'''
+
+MENU = '''---
+kind: partial
+---
+.twelve.columns
+  %ul.menu
+    %li.menu
+      %a{"href": "/index.html"} Contents
+    %li.menu
+      %a{"href": "/about.html"} About
+'''
+
+FOOTER = '''---
+kind: partial
+---
+- this_ch = int(self.page.get('chapter', -1))
+- next_ch = find_page('chapter', this_ch + 1)
+.container.footer
+  .row
+    Next
+    - if next_ch:
+      = anchor_for_page(next_ch)
+  .row
+    Related
+    %ul.related
+      - for p in related(6):
+        %li.related_page
+          = anchor_for_page(p)
+  .row
+    Recent
+    %ul.recent
+      - for p in articles(6):
+        %li.recent_page
+          = anchor_for_page(p)
+'''
+
+HAML_LAYOUT = '''---
+kind: layout
+---
+%html
+  = include('_head.haml')
+  %body
+    .container.page
+      .row
+        .twelve.columns.header
+          = include('_masthead.haml')
+      .row
+        .twelve.columns.left.main
+          .text
+            = include(self.path, full_path=True)
+      .row
+        = include('{partial}')
+      .row
+        .twelve.columns.left.footer
+          = include('_footer.haml')
+'''
+
+EPY_LAYOUT = '''---
+kind: layout
+---
+<html>
+<%= include('_head.haml') %>
+<body>
+  <div class="container page">
+    <div class="header"><%= include('_masthead.haml') %></div>
+    <div class="text"><%= include(self.path, full_path=True) %></div>
+    <div class="row"><%= include('{partial}') %></div>
+    <div class="footer"><%= include('_footer.haml') %></div>
+  </div>
+</body>
+</html>
+'''
+
+PARTIAL = '''---
+kind: partial
+---
+.sidebar
+  %p.note Sidebar {n}
+  %ul
+    - for i in range(3):
+      %li= i
+{include}'''
+
+INDEX = '''---
+title: Contents
+kind: page
+id: index
+layout: {layout}
+---
+
+## Contents
+
+<%! for p in sort_by(articles(), 'chapter', 999999): %>
+* [<%= p['title'] %>](<%= p['url'] %>) <%= p['date'] %>
+<%! end %>
+'''
+
+ABOUT = '''---
+title: About
+kind: page
+id: about
+layout: {layout}
+---
+
+This site was generated for benchmarking [QRN](https://github.com/russolsen/qrn).
+'''
+
+ARTICLE = '''---
+title: {title}
+id: article-{n}
+layout: {layout}
+date: {date}
+chapter: {n}
+kind: article
+category: {category}
+---
+
+## {title}
+
+{body}
+'''
+
+STYLES = '''@import 'colors';
+@import 'fonts';
+@import 'custom_{n}';
+
+.page-{n} {{ color: $text-color; font-family: $body-font; }}
+'''
+
+def sentence(rng, n=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(n)).capitalize() + '.'
+
+def paragraph(rng, n=5):
+    return '\n'.join(sentence(rng) for _ in range(n))
+
+def article_body(rng, paragraphs):
+    parts = []
+    for i in range(paragraphs):
+        if i and i % 4 == 0:
+            parts.append(f'### Part {i // 4}')
+        parts.append(paragraph(rng))
+    parts.append("This is chapter <%= page['chapter'] %> of <%= len(articles()) %>.")
+    return '\n\n'.join(parts)
+
+def layout_names(layouts):
+    return [f'layout_{i}.haml' if i % 2 == 0 else f'layout_{i}.html' for i in range(layouts)]
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+# Written into every generated site, so that it can safely be replaced.
+MARKER = '.qrn-synth'
+
+def generate(root, articles=500, layouts=4, stylesheets=4, categories=10,
+             paragraphs=12, partial_depth=2, seed=1):
+    '''Create a synthetic site under root. Root must be missing, empty
+    or a site made by an earlier generate, which is replaced.'''
+    root = Path(root)
+    if root.exists():
+        if any(root.iterdir()) and not Path(root, MARKER).exists():
+            raise Exception(f'{root} is not empty and not a generated site, refusing to replace it')
+        shutil.rmtree(root)
+    root.mkdir(parents=True)
+    Path(root, MARKER).write_text('Generated by benchmarks.synth, may be deleted.\n')
+    rng = random.Random(seed)
+    src = Path(root, 'src')
+    lay = Path(src, '_layouts')
+
+    write(Path(lay, '_head.haml'), HEAD)
+    write(Path(lay, '_masthead.haml'), MASTHEAD)
+    write(Path(lay, '_menu.haml'), MENU)
+    write(Path(lay, '_footer.haml'), FOOTER)
+
+    names = layout_names(layouts)
+    for i, name in enumerate(names):
+        # Each layout includes its own chain of nested partials.
+        for d in range(partial_depth):
+            inner = f'= include(\'_partial_{i}_{d+1}.haml\')\n' if d + 1 < partial_depth else ''
+            write(Path(lay, f'_partial_{i}_{d}.haml'), PARTIAL.format(n=f'{i}.{d}', include=inner))
+        template = HAML_LAYOUT if name.endswith('.haml') else EPY_LAYOUT
+        write(Path(lay, name), template.replace('{partial}', f'_partial_{i}_0.haml'))
+
+    write(Path(src, 'index.md'), INDEX.format(layout=names[0]))
+    write(Path(src, 'about.md'), ABOUT.format(layout=names[0]))
+
+    start = datetime.date(2010, 1, 1)
+    for n in range(articles):
+        title = f'{sentence(rng, 3)[:-1]} {n}'
+        write(Path(src, 'articles', f'category_{n % categories}', f'article_{n}.md'), ARTICLE.format(
+            title=title,
+            n=n,
+            layout=names[n % len(names)],
+            date=start + datetime.timedelta(days=n),
+            category=f'category_{n % categories}',
+            body=article_body(rng, paragraphs)))
+
+    css = Path(src, 'stylesheets')
+    write(Path(css, '_colors.scss'), '$text-color: #222;\n')
+    write(Path(css, '_fonts.scss'), '$body-font: serif;\n')
+    for n in range(stylesheets):
+        write(Path(css, f'_custom_{n}.scss'), f'.custom-{n} {{ margin: {n}px; }}\n')
+        write(Path(css, f'styles_{n}.scss'), STYLES.format(n=n))
+
+    write(Path(src, 'files', 'notes.txt'), paragraph(rng, 50))
+    return root
+
+def edit_article(root, n=0):
+    '''Change the body, not the header, of one article.'''
+    paths = sorted(Path(root, 'src', 'articles').glob(f'*/article_{n}.md'))
+    with open(paths[0], 'a') as f:
+        f.write('\nAn edit.\n')
+    return paths[0]
+
+def edit_layout(root, i=0):
+    '''Change one of the partials used by a single layout.'''
+    path = Path(root, 'src', '_layouts', f'_partial_{i}_0.haml')
+    with open(path, 'a') as f:
+        f.write('%p.edit An edit.\n')
+    return path
@@ -20,7 +20,11 @@ def main():
 
     build_site(site)
 
-#import cProfile
-#cProfile.run('main()')
+# Uncomment to see where the build time goes.
+#import qrn.timing as timing
+#timing.enable()
 
 main()
+
+#print(timing.timings.report())
+#timing.timings.write_chrome_trace('trace.json')
@@ -0,0 +1,123 @@
+'''Ways of getting static assets from src into the build directory.'''
+
+import filecmp
+import logging
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The Linux ioctl that makes dst share src's blocks (btrfs, xfs, ...).
+FICLONE = 0x40049409
+
+def _copy(src, dst):
+    '''Plain copy. On Linux shutil already copies in the kernel.'''
+    shutil.copyfile(src, dst)
+    return 'copied'
+
+def _sendfile(src, dst):
+    '''Copy with os.sendfile, without passing the bytes through Python.'''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+    return 'copied'
+
+def _reflink(src, dst):
+    '''Clone the file if the filesystem can, otherwise copy it with
+    copy_file_range, which some filesystems also turn into a clone.'''
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return 'linked'
+            except OSError:
+                pass
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        while copied < size:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+    return 'copied'
+
+def _hardlink(src, dst):
+    '''Make the output another name for the source file. Note that
+    changing the output in place would also change the source.'''
+    tmp_path = f'{dst}.tmp'
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    os.link(src, tmp_path)
+    os.replace(tmp_path, dst)
+    return 'linked'
+
+STRATEGIES = {
+        'copy': _copy,
+        'sendfile': _sendfile,
+        'reflink': _reflink,
+        'hardlink': _hardlink}
+
+KINDS = ['copied', 'linked', 'skipped']
+
+def _identical(src, dst, size):
+    '''Return true if dst already has the same contents as src.'''
+    try:
+        if os.path.samefile(src, dst):
+            return True
+        if os.path.getsize(dst) != size:
+            return False
+    except FileNotFoundError:
+        return False
+    return filecmp.cmp(src, dst, shallow=False)
+
+class AssetCopier:
+    '''Copies assets with one of the STRATEGIES, falling back on a plain
+    copy if the strategy doesn't work here. Outputs that already hold
+    the right bytes are left alone. Keeps count of the files and bytes
+    copied, linked and skipped.'''
+
+    def __init__(self, strategy='copy'):
+        if strategy not in STRATEGIES:
+            raise Exception(f'Unknown asset strategy: {strategy}')
+        self.strategy = strategy
+        self.totals = dict.fromkeys(KINDS + [f'{k}_bytes' for k in KINDS], 0)
+        self.pending = dict(self.totals)
+
+    def copy(self, src, dst):
+        '''Get the contents of src into dst.'''
+        size = os.path.getsize(src)
+        if _identical(src, dst, size):
+            logging.info('Unchanged: %s', dst)
+            kind = 'skipped'
+        else:
+            logging.info('Copy file %s => %s (%s)', src, dst, self.strategy)
+            try:
+                kind = STRATEGIES[self.strategy](src, dst)
+            except (OSError, AttributeError) as e:
+                logging.info('Cannot %s %s, copying: %s', self.strategy, src, e)
+                kind = _copy(src, dst)
+        self.pending[kind] += 1
+        self.pending[f'{kind}_bytes'] += size
+
+    def drain(self):
+        '''Return and forget the counts since the last drain.'''
+        pending = self.pending
+        self.pending = dict.fromkeys(pending, 0)
+        return pending
+
+    def merge(self, counts):
+        '''Add counts returned by drain.'''
+        for k, v in counts.items():
+            self.totals[k] += v
+
+    def stats(self):
+        '''Return a dictionary of the counts.'''
+        return {k: v + self.pending[k] for k, v in self.totals.items()}
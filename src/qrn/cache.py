@@ -0,0 +1,102 @@
+'''Simple persistent caches stored as files under a directory.'''
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+
+class DiskCache:
+    '''A directory of files, each holding the bytes stored under a key.
+
+    If max_bytes is given the cache is kept under that size by evicting
+    the least recently used entries. Reading an entry touches its file,
+    so file mtimes track use.'''
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.size = None
+
+    def path_for(self, key):
+        '''Return the path of the file that holds the value for key.'''
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return Path(self.directory, digest[:2], digest[2:])
+
+    def get(self, key):
+        '''Return the bytes stored under key, or None.'''
+        path = self.path_for(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self.max_bytes:
+            os.utime(path)
+        return data
+
+    def put(self, key, data):
+        '''Store the bytes under key, replacing any previous value.'''
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        old_size = self.__file_size(path) if self.max_bytes else 0
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        if self.max_bytes:
+            if self.size is None:
+                self.size = sum(st.st_size for _, st in self.entries())
+            else:
+                self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def remove(self, key):
+        '''Remove the value stored under key, if any.'''
+        path = self.path_for(key)
+        old_size = self.__file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        if self.size is not None:
+            self.size -= old_size
+
+    def __file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def entries(self):
+        '''Yield the path and stat of each of the cache files.'''
+        if not self.directory.is_dir():
+            return
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    yield entry.path, entry.stat()
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        '''Remove least recently used entries until the cache is 90% of max_bytes.'''
+        entries = sorted(self.entries(), key=lambda e: e[1].st_mtime)
+        size = sum(st.st_size for _, st in entries)
+        limit = self.max_bytes * 0.9
+        removed = 0
+        for path, st in entries:
+            if size <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= st.st_size
+            removed += 1
+        logging.info('Evicted %d entries from %s', removed, self.directory)
+        self.size = size
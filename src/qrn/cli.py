@@ -0,0 +1,219 @@
+'''The qrn command: build, clean, index, profile, watch and serve a site.
+
+Run it in the directory that holds src. The site attributes (title,
+url, ...) come from site.yaml, which may also have a build section
+with defaults for any of the command line options, e.g.
+
+    title: My Site
+    url: http://example.com
+    build:
+      jobs: 4
+      md_batch_size: 50
+'''
+
+import argparse
+import logging
+import shutil
+import sys
+import yaml
+from pathlib import Path
+import qrn.assets as assets
+import qrn.converters as converters
+import qrn.qrn as qrn
+import qrn.server as server
+import qrn.timing as timing
+import qrn.utils as utils
+import qrn.watch as watch
+
+# The options that can be set in the build section of site.yaml.
+DEFAULTS = {
+        'output_dir': 'build',
+        'cache_dir': qrn.CACHE_DIR,
+        'jobs': 1,
+        'md_batch_size': 1,
+        'markdown': None,
+        'assets': 'copy',
+        'index_attrs': [],
+        'log_level': 'SUMMARY',
+        'log_file': None,
+        'host': 'localhost',
+        'port': 8000,
+        'interval': 0.5}
+
+LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+def load_config(path):
+    '''Read site.yaml, returning the site attributes and the build options.'''
+    if not Path(path).exists():
+        return {}, {}
+    # Not utils.read_yaml, which logs before logging is set up.
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    build = config.pop('build', None) or {}
+    for key in build:
+        if key not in DEFAULTS:
+            raise Exception(f'{path}: unknown build option {key}')
+    return config, build
+
+def options(args, build):
+    '''Combine the command line with the build options from site.yaml.
+    The command line wins.'''
+    opts = utils.EasyDict(vars(args))
+    for key, default in DEFAULTS.items():
+        if opts.get(key, None) is None:
+            opts[key] = build.get(key, default)
+    if not opts.cache_dir:
+        opts['cache_dir'] = None
+    return opts
+
+def setup_logging(opts):
+    level = opts.log_level.upper()
+    if level == 'SUMMARY':
+        level = 'WARNING'
+    if opts.log_file:
+        logging.basicConfig(
+                filename=opts.log_file, filemode='w', level=level, format=LOG_FORMAT)
+    else:
+        logging.basicConfig(level=level, format=LOG_FORMAT)
+    if opts.log_level.upper() == 'SUMMARY':
+        qrn.log_summary_only()
+
+def load_site(opts):
+    '''Index the pages and add the attributes from site.yaml.'''
+    site = qrn.build_indices(opts.output_dir, opts.index_attrs)
+    site.update(opts.site)
+    return site
+
+def do_build(opts):
+    site = load_site(opts)
+    ok = qrn.build_site(
+            site, opts.output_dir, opts.cache_dir, opts.md_batch_size, opts.jobs,
+            force=opts.force, assets=opts.assets, prune=opts.prune)
+    return 0 if ok else 1
+
+def removable(directory):
+    '''Return true if directory is safe to remove: somewhere under the
+    current directory and not holding src.'''
+    target = Path(directory).resolve()
+    src = Path('src').resolve()
+    if Path.cwd().resolve() not in target.parents:
+        return False
+    return target != src and target not in src.parents
+
+def do_clean(opts):
+    for directory in [opts.output_dir, opts.cache_dir]:
+        if not directory or not Path(directory).exists():
+            continue
+        if not removable(directory):
+            raise Exception(f'Refusing to remove {directory}')
+        print('Removing', directory)
+        shutil.rmtree(directory)
+    return 0
+
+def do_index(opts):
+    site = load_site(opts)
+    print(f'{len(site.all_pages)} pages, {len(site.articles)} articles')
+    for category, pages in sorted(site.by_category.items(), key=lambda kv: str(kv[0])):
+        print(f'  {category}: {len(pages)}')
+    if opts.verbose:
+        for page in site.all_pages:
+            print(page['url'], page.get('title', ''))
+    return 0
+
+def do_profile(opts):
+    timing.enable()
+    try:
+        result = do_build(opts)
+    finally:
+        timings = timing.disable()
+    print(timings.report(opts.top))
+    if opts.json:
+        timings.write_json(opts.json)
+    if opts.trace:
+        timings.write_chrome_trace(opts.trace)
+    return result
+
+def do_watch(opts):
+    site = load_site(opts)
+    watch.watch(
+            site, opts.output_dir, opts.cache_dir, opts.md_batch_size, opts.jobs,
+            opts.interval, opts.assets)
+    return 0
+
+def do_serve(opts):
+    site = load_site(opts)
+    server.serve(site, opts.host, opts.port, opts.output_dir, opts.cache_dir)
+    return 0
+
+def parser():
+    '''Return the argument parser for the qrn command.'''
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', default='site.yaml',
+            help='site config file (default site.yaml)')
+    common.add_argument('--output-dir', help='where to put the built site (default build)')
+    common.add_argument('--cache-dir',
+            help=f'where to keep the build caches, "" for none (default {qrn.CACHE_DIR})')
+    common.add_argument('--log-level',
+            help='DEBUG, INFO, SUMMARY (the default, warnings plus build summaries), WARNING or ERROR')
+    common.add_argument('--log-file', help='log to this file instead of stderr')
+
+    building = argparse.ArgumentParser(add_help=False)
+    building.add_argument('-j', '--jobs', type=int, help='number of worker processes')
+    building.add_argument('--md-batch-size', type=int,
+            help='convert markdown this many documents at a time')
+    building.add_argument('--markdown', choices=list(converters.MARKDOWN_BACKENDS),
+            help='markdown converter (default pandoc if installed)')
+    building.add_argument('--assets', choices=list(assets.STRATEGIES),
+            help='how to copy static files (default copy)')
+
+    result = argparse.ArgumentParser(prog='qrn', description='QRN static site generator.')
+    commands = result.add_subparsers(dest='command', metavar='command', required=True)
+
+    p = commands.add_parser('build', parents=[common, building], help='build the site')
+    p.add_argument('-f', '--force', action='store_true',
+            help='rebuild everything, even if it looks up to date')
+    p.add_argument('--prune', action='store_true',
+            help='remove outputs whose sources have been deleted')
+    p.set_defaults(run=do_build)
+
+    p = commands.add_parser('clean', parents=[common], help='remove the built site and the caches')
+    p.set_defaults(run=do_clean)
+
+    p = commands.add_parser('index', parents=[common], help='index the pages and summarize them')
+    p.add_argument('-v', '--verbose', action='store_true', help='list every page')
+    p.set_defaults(run=do_index)
+
+    p = commands.add_parser('profile', parents=[common, building],
+            help='build the site and report where the time went')
+    p.add_argument('-f', '--force', action='store_true',
+            help='rebuild everything, even if it looks up to date')
+    p.add_argument('--prune', action='store_true',
+            help='remove outputs whose sources have been deleted')
+    p.add_argument('--top', type=int, default=20, help='how many of the slowest to show')
+    p.add_argument('--json', help='write the timings to this json file')
+    p.add_argument('--trace', help='write a Chrome trace to this file')
+    p.set_defaults(run=do_profile)
+
+    p = commands.add_parser('watch', parents=[common, building],
+            help='build the site and rebuild it as files change')
+    p.add_argument('--interval', type=float, help='seconds between checks for changes')
+    p.set_defaults(run=do_watch)
+
+    p = commands.add_parser('serve', parents=[common],
+            help='serve the site, rendering pages as they are asked for')
+    p.add_argument('--host', help='address to listen on (default localhost)')
+    p.add_argument('--port', type=int, help='port to listen on (default 8000)')
+    p.set_defaults(run=do_serve)
+    return result
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    site, build_config = load_config(args.config)
+    opts = options(args, build_config)
+    opts['site'] = site
+    setup_logging(opts)
+    converters.set_markdown_backend(opts.markdown)
+    return opts.run(opts)
+
+if __name__ == '__main__':
+    sys.exit(main())
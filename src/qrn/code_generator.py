@@ -9,11 +9,18 @@ import logging
 
 SplitRE = r'(?=<%)|=%>\n?|!%>\n?|%>'
 
+# Bump when the generated code changes, so that cached code is recompiled.
+CODE_FORMAT = 3
+
 START_RE = re.compile(r'.*:$')
 END_RE = re.compile(r' *end *$')
 
 class CodeGenerator:
-    '''Create Python code.'''
+    '''Create Python code.
+
+    Adjacent literal text is held back and written out as a single
+    append, so static markup costs one statement no matter how many
+    pieces it was generated in.'''
 
     def __init__(self, desc="Template"):
         self.desc = desc
@@ -22,18 +29,36 @@ class CodeGenerator:
 
     def clear(self):
         '''Start over: clear all of the accumulated output.'''
-        self.output = ''
+        self._output = []
+        self.pending_text = []
+
+    @property
+    def output(self):
+        '''The generated code.'''
+        self.flush_text()
+        return ''.join(self._output)
 
     def _write(self, *values):
         for v in values:
-          self.output += str(v)
+          self._output.append(str(v))
+
+    def flush_text(self):
+        '''Write out the held back literal text.'''
+        if not self.pending_text:
+            return
+        text = ''.join(self.pending_text)
+        self.pending_text = []
+        self.emit_indent()
+        self._write(utils.OUTPUT_NAME, '.append(', repr(text), ')\n')
 
     def indent(self):
         '''Indent the Python code by one level.'''
+        self.flush_text()
         self.depth += 1
 
     def dedent(self):
         '''Decrease the the Python code indentation by one level.'''
+        self.flush_text()
         self.depth -= 1
 
     def emit_indent(self):
@@ -41,23 +66,26 @@ class CodeGenerator:
         self._write(' '*(self.depth*2))
 
     def text(self, text, line_no=None):
-        '''Write a print statement to print the text to the output.'''
+        '''Append the text to the output, merged with any adjacent text.'''
         if line_no:
+            self.flush_text()
             self.emit_indent()
             self._write(f'line_no={line_no}')
-        self.emit_indent()
-        self._write('print(', repr(text), ', end="")\n')
+        self.pending_text.append(text)
 
     def expr(self, expr, line_no=None):
-        '''Write a print statement to print the results of the expression to the output.'''
+        '''Write a statement that appends the value of the expression to the output.'''
+        self.flush_text()
         if line_no:
             self.emit_indent()
             self._write(f'line_no={line_no}')
         self.emit_indent()
-        self._write('print(', expr, ', end="")\n')
+        # Like print, a, b comes out as the values separated by a space.
+        self._write(utils.OUTPUT_NAME, ".append(' '.join(map(str, (", expr, ',))))\n')
 
     def code(self, code):
         '''Write a some code to the output.'''
+        self.flush_text()
         self.emit_indent()
         self._write(f'{code}\n')
 
@@ -1,17 +1,40 @@
 '''Functions to help build the processing pipeline.'''
 
 from pathlib import Path
+import os
 import shutil
 import logging
+import qrn.records as records
 import qrn.utils as utils
 from qrn.pipeline import NOT_APPLICABLE, COMPLETE
 
-def to_dependency_f(target_dir, suffix=None, other_deps=[]):
-    '''Return a function that will generate dependancies to a given dir and suffix.'''
+# The suffixes of the source files that turn into html and css.
+HTML_SUFFIXES = ['.md', '.html', '.haml']
+CSS_SUFFIXES = ['.scss', '.sass', '.css']
+
+def possible_sources(relative, src_dir='src'):
+    '''Return the source files that an output, at the path relative to
+    the output directory, could have been built from.'''
+    path = Path(src_dir, relative)
+    if path.suffix == '.html':
+        return [path.with_suffix(s) for s in HTML_SUFFIXES]
+    if path.suffix == '.css':
+        return [path.with_suffix(s) for s in CSS_SUFFIXES]
+    return [path]
+
+def to_dependency_f(target_dir, suffix=None, other_deps=[], graph=None):
+    '''Return a function that will generate dependancies to a given dir and suffix.
+
+    If a dependency graph is supplied and it knows what the output was
+    built from last time, those files replace other_deps.'''
     def to_dependancy(path):
         opath = utils.relocate(path, target_dir, suffix)
-        logging.debug('To dep %s => %s', path, opath)
-        return {'output': opath, 'sources':([path] + other_deps)}
+        if utils.DEBUG:
+            logging.debug('To dep %s => %s', path, opath)
+        deps = graph and graph.sources_for(opath)
+        if deps is None:
+            deps = other_deps
+        return {'output': opath, 'sources':([path] + deps)}
     return to_dependancy
 
 def is_suffix_f(*suffixes):
@@ -28,17 +51,67 @@ def is_dir(path):
         return path
     return NOT_APPLICABLE
 
-def isoutdated(context):
-    '''Pipline function that checks if any one of the sources is out of date.'''
+def sources_outdated(context, manifest=None):
+    '''Return true if any one of the sources is newer than the output.
+
+    If there is a build manifest that knows about the output, the file
+    contents are compared instead of the modification times.'''
     output = context['output']
     sources = context['sources']
+    if manifest and manifest.knows(output):
+        return manifest.is_outdated(output, sources)
     for s in sources:
+        if not os.path.exists(s):
+            logging.info('Ouput file %s depends on missing %s.', output, s)
+            return True
         if utils.newer(s, output):
             logging.info('Ouput file %s is out of date wrt %s.', output, s)
-            return context
-    logging.info('Up to date: %s', output)
+            return True
+    return False
+
+def isoutdated(context):
+    '''Pipline function that checks if any one of the sources is out of date.'''
+    if sources_outdated(context):
+        return context
+    logging.info('Up to date: %s', context['output'])
     return COMPLETE
 
+def isoutdated_f(manifest):
+    '''Return a pipeline function like isoutdated that consults the build manifest.'''
+    def _isoutdated(context):
+        if sources_outdated(context, manifest):
+            return context
+        logging.info('Up to date: %s', context['output'])
+        return COMPLETE
+    return _isoutdated
+
+def outdated(context):
+    '''Pipeline function that treats the output as out of date, for forced builds.'''
+    return context
+
+def record_build_f(manifest):
+    '''Return a pipeline function that records the hashes of the sources
+    of the output in the build manifest.'''
+    def _record_build(context):
+        sources = context['sources']
+        if 'dependencies' in context:
+            # Next time the sources will be the files the page really used.
+            sources = sources[:1] + sorted(context['dependencies'])
+        manifest.record(context['output'], sources)
+        return context
+    return _record_build
+
+def record_dependencies_f(graph):
+    '''Return a pipeline function that records the files and index queries
+    the output was built from.'''
+    def _record_dependencies(context):
+        graph.record(
+                context['output'],
+                context.get('dependencies', []),
+                context.get('queries', []))
+        return context
+    return _record_dependencies
+
 def ispublished(context):
     '''Pipline function that checks the published attribute.'''
     attrs = context['attrs']
@@ -55,6 +128,13 @@ def copy_file(context):
     shutil.copyfile(ipath, opath)
     return context
 
+def copy_file_f(copier):
+    '''Return a pipeline function that copies the file with an AssetCopier.'''
+    def _copy_file(context):
+        copier.copy(context['sources'][0], context['output'])
+        return context
+    return _copy_file
+
 def print_it(context):
     '''Debugging pipline function.'''
     print("Print it: ", end='')
@@ -84,6 +164,37 @@ def read_attrs(context):
     context['attrs'] = attrs
     return context
 
+def read_attrs_f(page_records):
+    '''Return a pipeline function like read_attrs that takes the attributes
+    from page_records, the records gathered while indexing, when it can.'''
+    def _read_attrs(context):
+        ipath = context['sources'][0]
+        record = records.current_record(page_records, ipath)
+        if not record:
+            return read_attrs(context)
+        attrs = utils.EasyDict(record.header)
+        attrs['ipath'] = ipath
+        attrs['opath'] = context['output']
+        context['attrs'] = attrs
+        context['record'] = record
+        return context
+    return _read_attrs
+
+def read_record_f(page_records):
+    '''Return a pipeline function that reads the input file's header into
+    a page record, adds it to page_records and sets up the attributes.'''
+    def _read_record(context):
+        ipath = context['sources'][0]
+        record = records.read_record(ipath)
+        page_records[ipath] = record
+        attrs = utils.EasyDict(record.header)
+        attrs['ipath'] = ipath
+        attrs['opath'] = context['output']
+        context['attrs'] = attrs
+        context['record'] = record
+        return context
+    return _read_record
+
 def create_dir(context):
     '''Pipeline function to create the output directory.'''
     opath = context['output']
@@ -1,5 +1,12 @@
+import hashlib
 import subprocess
 import logging
+import re
+import shutil
+import uuid
+from pathlib import Path
+import qrn.timing as timing
+import qrn.utils as utils
 
 # This file is the interface to the major non-python
 # dependencies used by doctrine. They are program
@@ -8,21 +15,151 @@ import logging
 
 def md_to_html(content):
     """Convert markdown to html."""
-    output = _pandoc(content, 'markdown', 'html')
-    return output
+    return md_to_html_batch([content])[0]
+
+# Set to a DiskCache to reuse the html from earlier conversions.
+markdown_cache = None
+
+def md_to_html_batch(contents, batch_size=50):
+    """Convert a list of markdown documents to a list of html documents."""
+    contents = list(contents)
+    name = _markdown_backend()
+    backend = MARKDOWN_BACKENDS[name]
+    if not markdown_cache:
+        return backend(contents, batch_size)
+
+    stamp = _markdown_stamp(name)
+    keys = []
+    for content in contents:
+        digest = hashlib.sha256((stamp + content).encode('utf-8')).hexdigest()
+        keys.append(f'markdown:{digest}')
+    results = [markdown_cache.get(k) for k in keys]
+    missing = [i for i, html in enumerate(results) if html is None]
+    logging.debug('Markdown cache: %d of %d cached.', len(contents)-len(missing), len(contents))
+    for i, html in enumerate(results):
+        if html is not None:
+            results[i] = html.decode('utf-8')
+    if missing:
+        outputs = backend([contents[i] for i in missing], batch_size)
+        for i, html in zip(missing, outputs):
+            markdown_cache.put(keys[i], html.encode('utf-8'))
+            results[i] = html
+    return results
 
 def sass_to_css(ipath, opath):
     """Convert a scss/sass file to a css file."""
-    logging.info('Sass conversion: %s => %s', ipath, opath)
-    cmd_list = ['sass', ipath, opath]
-    _run_external(cmd_list)
-    return
+    sass_to_css_batch([(ipath, opath)])
+
+def sass_to_css_batch(pairs):
+    """Convert a list of (scss/sass file, css file) pairs with one run of sass."""
+    for ipath, opath in pairs:
+        logging.info('Sass conversion: %s => %s', ipath, opath)
+    cmd_list = ['sass'] + [f'{ipath}:{opath}' for ipath, opath in pairs]
+    with timing.stage('sass', pairs[0][0] if len(pairs) == 1 else None):
+        _run_external(cmd_list)
+
+# @use, @forward and @import rules, and the quoted urls in them.
+SASS_RULE_RE = re.compile(r'^\s*@(?:use|forward|import)\s+([^;{\n]+)', re.M)
+SASS_URL_RE = re.compile(r'''['"]([^'"]+)['"]''')
+
+def _resolve_sass_url(directory, url):
+    """Find the file a sass @use/@import url refers to, the way sass does."""
+    if url.startswith('sass:') or '://' in url or url.endswith('.css'):
+        return None
+    path = Path(directory, url)
+    name = path.name
+    candidates = []
+    for stem in [name, f'_{name}']:
+        if path.suffix in ['.scss', '.sass']:
+            candidates.append(path.with_name(stem))
+        else:
+            candidates += [path.with_name(stem + s) for s in ['.scss', '.sass', '.css']]
+    candidates += [Path(path, f'{i}{s}') for i in ['_index', 'index'] for s in ['.scss', '.sass']]
+    return next((c for c in candidates if c.is_file()), None)
+
+def sass_dependencies(path):
+    """Return the files a scss/sass file loads with @use, @forward or
+    @import, directly or indirectly, sorted."""
+    found = set()
+    todo = [Path(path)]
+    while todo:
+        current = todo.pop()
+        text = utils.read_file(current)
+        for rule in SASS_RULE_RE.findall(text):
+            urls = SASS_URL_RE.findall(rule)
+            if not urls and current.suffix == '.sass':
+                # The indented syntax doesn't need quotes.
+                urls = [u.strip() for u in rule.split(',')]
+            for url in urls:
+                dep = _resolve_sass_url(current.parent, url)
+                if dep is None:
+                    if utils.DEBUG:
+                        logging.debug('Sass: no file for %s in %s', url, current)
+                elif dep not in found:
+                    found.add(dep)
+                    todo.append(dep)
+    found.discard(Path(path))
+    return sorted(found)
+
+# Set to a DiskCache to reuse the css from earlier conversions.
+css_cache = None
+
+__sass_stamp = None
+
+def _sass_stamp():
+    """Return a string identifying the sass version."""
+    global __sass_stamp
+    if __sass_stamp is None:
+        version = _run_external_filter(['sass', '--version'], '').strip()
+        __sass_stamp = f'{version}|sass|'
+    return __sass_stamp
+
+class SassBatch:
+    """Collects stylesheets and converts them with a single run of sass.
+
+    If cache is set to a DiskCache, the css for each stylesheet is kept
+    there keyed by the contents of the stylesheet and every file it
+    loads, and a stylesheet that is found there is not converted at all."""
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.pending = []
+
+    def __key(self, ipath, dependencies):
+        hasher = hashlib.sha256(_sass_stamp().encode('utf-8'))
+        for path in [ipath] + list(dependencies):
+            hasher.update(f'{path}\n'.encode('utf-8'))
+            hasher.update(Path(path).read_bytes())
+        return f'css:{hasher.hexdigest()}'
+
+    def add(self, ipath, opath, dependencies=()):
+        """Queue the conversion of ipath, which loads dependencies, to opath."""
+        key = None
+        if self.cache:
+            key = self.__key(ipath, dependencies)
+            css = self.cache.get(key)
+            if css is not None:
+                logging.info('Sass cache hit: %s => %s', ipath, opath)
+                utils.write_file(css, opath, 'wb', compare=True)
+                return
+        self.pending.append((ipath, opath, key))
+
+    def flush(self):
+        """Convert all of the queued stylesheets."""
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+        sass_to_css_batch([(ipath, opath) for ipath, opath, _ in pending])
+        if self.cache:
+            for _, opath, key in pending:
+                self.cache.put(key, Path(opath).read_bytes())
 
 def _run_external_filter(cmd_list, itext):
     """Given an argv array and some input, run a command, return output."""
     result = subprocess.run(
-            cmd_list, 
-            capture_output=True, 
+            cmd_list,
+            capture_output=True,
             text=True, input=itext)
 
     result.check_returncode()
@@ -34,8 +171,211 @@ def _run_external(cmd_list):
     result.check_returncode()
     return result.stdout
 
+def _pandoc_args(ipd, opd):
+    return ['pandoc', '--from', ipd, '--to', opd]
+
 def _pandoc(content, ipd, opd):
     """Run pandoc, converting from to/from the given formats."""
-    cmd_list = ['pandoc', '--from', ipd, '--to', opd]
-    output = _run_external_filter(cmd_list, content)
+    cmd_list = _pandoc_args(ipd, opd)
+    with timing.stage('pandoc'):
+        output = _run_external_filter(cmd_list, content)
     return output
+
+# Markdown backends. Each one takes a list of markdown documents and
+# a batch size and returns the corresponding list of html documents.
+
+# Footnotes and reference links are resolved across the whole pandoc
+# input, so documents that use them always get a pandoc run of their own.
+OWN_RUN_RE = re.compile(r'\[\^|^ {0,3}\[[^\]]+\]:', re.M)
+ATX_HEADING_RE = re.compile(r'^ {0,3}#{1,6}[ \t]+(.*?)[ \t#]*$', re.M)
+SETEXT_HEADING_RE = re.compile(r'^(\S.*)\n(?:=+|-+)[ \t]*$', re.M)
+HTML_HEADING_ID_RE = re.compile(r'<h[1-6] id="([^"]*)"')
+
+def _heading_id(heading):
+    """Approximate pandoc's automatic id for a heading: drop punctuation
+    other than _ - and ., turn spaces into hyphens, lower case and drop
+    everything before the first letter, defaulting to section."""
+    ident = re.sub(r'[^\w\s.-]', '', heading.lower())
+    ident = re.sub(r'\s+', '-', ident.strip())
+    ident = re.sub(r'^[^a-z]+', '', ident)
+    return ident or 'section'
+
+def _heading_ids(content):
+    """Approximate the automatic ids pandoc will give the headings."""
+    headings = ATX_HEADING_RE.findall(content) + SETEXT_HEADING_RE.findall(content)
+    return set(_heading_id(h) for h in headings)
+
+def _ids_renamed(results):
+    """Return true if pandoc seems to have renamed a heading id in one
+    document of a batch, x to x-1 say, because another had it too."""
+    seen = set()
+    for html in results:
+        ids = HTML_HEADING_ID_RE.findall(html)
+        for ident in ids:
+            m = re.match(r'(.*)-\d+$', ident)
+            if m and m.group(1) in seen:
+                return True
+        seen.update(ids)
+    return False
+
+def _group_for_pandoc(contents, batch_size):
+    """Split the indices of contents into groups that can share a pandoc run.
+
+    Pandoc dedups heading ids across its input, so no two documents
+    in a group may have headings that would get the same id."""
+    groups = []
+    group = []
+    group_ids = set()
+    for i, content in enumerate(contents):
+        if OWN_RUN_RE.search(content):
+            groups.append([i])
+            continue
+        ids = _heading_ids(content)
+        if len(group) >= batch_size or (ids & group_ids):
+            groups.append(group)
+            group = []
+            group_ids = set()
+        group.append(i)
+        group_ids |= ids
+    if group:
+        groups.append(group)
+    return groups
+
+def _pandoc_group(docs):
+    """Convert several documents with one run of pandoc."""
+    if len(docs) == 1:
+        return [_pandoc(docs[0], 'markdown', 'html')]
+    marker = f'QRNBATCH{uuid.uuid4().hex}'
+    separator = f'\n\n{marker}\n\n'
+    output = _pandoc(separator.join(docs), 'markdown', 'html')
+    results = re.split(f'^<p>{marker}</p>\n', output, flags=re.M)
+    if len(results) != len(docs):
+        logging.warning('Pandoc batch did not split cleanly, converting one at a time.')
+        return [_pandoc(d, 'markdown', 'html') for d in docs]
+    if _ids_renamed(results):
+        logging.info('Pandoc batch renamed heading ids, converting one at a time.')
+        return [_pandoc(d, 'markdown', 'html') for d in docs]
+    return results
+
+def pandoc_backend(contents, batch_size):
+    """Convert markdown with pandoc, batch_size documents per run."""
+    results = [None] * len(contents)
+    for group in _group_for_pandoc(contents, batch_size):
+        logging.debug('Pandoc run for %d documents.', len(group))
+        outputs = _pandoc_group([contents[i] for i in group])
+        for i, output in zip(group, outputs):
+            results[i] = output
+    return results
+
+def python_markdown_backend(contents, batch_size):
+    """Convert markdown in process with the Python-Markdown library."""
+    import markdown
+    md = markdown.Markdown(extensions=['extra'])
+    results = []
+    for content in contents:
+        with timing.stage('python-markdown'):
+            results.append(md.reset().convert(content) + '\n')
+    return results
+
+MARKDOWN_BACKENDS = {
+        'pandoc': pandoc_backend,
+        'python': python_markdown_backend}
+
+__markdown_backend = None
+__markdown_stamps = {}
+
+def set_markdown_backend(name):
+    """Select the markdown backend by name, None picks one automatically."""
+    global __markdown_backend
+    if name and name not in MARKDOWN_BACKENDS:
+        raise Exception(f'Unknown markdown backend: {name}')
+    __markdown_backend = name
+
+def _markdown_backend():
+    """Return the name of the markdown backend, falling back to Python if pandoc is missing."""
+    global __markdown_backend
+    if not __markdown_backend:
+        __markdown_backend = 'pandoc'
+        if not shutil.which('pandoc'):
+            try:
+                import markdown
+                logging.warning('pandoc not found, using Python-Markdown.')
+                __markdown_backend = 'python'
+            except ImportError:
+                pass
+    return __markdown_backend
+
+def _markdown_stamp(name):
+    """Return a string identifying the backend version and arguments."""
+    stamp = __markdown_stamps.get(name, None)
+    if stamp is None:
+        if name == 'pandoc':
+            version = _run_external_filter(['pandoc', '--version'], '').split('\n')[0]
+            args = ' '.join(_pandoc_args('markdown', 'html'))
+            stamp = f'{version}|{args}|'
+        else:
+            import markdown
+            stamp = f'python-markdown {markdown.__version__}|extra|'
+        __markdown_stamps[name] = stamp
+    return stamp
+
+class MarkdownBatch:
+    """Collects markdown documents and converts them in batches.
+
+    Instead of html, add returns a unique token standing in for the
+    converted document. Text holding tokens is handed to later, and
+    once flush has converted everything, it is called with the html
+    substituted for the tokens."""
+
+    def __init__(self, size):
+        self.size = size
+        self.prefix = f'qrnmd{uuid.uuid4().hex}n'
+        self.token_re = re.compile(self.prefix + r'(\d+)x')
+        self.docs = []
+        self.callbacks = []
+
+    def add(self, content):
+        """Queue some markdown, returning the token that stands in for the html."""
+        token = f'{self.prefix}{len(self.docs)}x'
+        self.docs.append(content)
+        return token
+
+    def has_tokens(self, text):
+        return self.prefix in text
+
+    def later(self, f, text):
+        """Call f with the resolved text once the batch has been flushed."""
+        self.callbacks.append((f, text))
+        if len(self.docs) >= self.size:
+            self.flush()
+
+    def resolve(self, text, results):
+        def _html(m):
+            return results[int(m.group(1))]
+        return self.token_re.sub(_html, text)
+
+    def flush(self):
+        """Convert all of the queued markdown and run the waiting callbacks."""
+        if not self.docs:
+            return
+        logging.info('Converting a batch of %d markdown documents.', len(self.docs))
+        results = [None] * len(self.docs)
+        waiting = list(range(len(self.docs)))
+        # Documents may include the output of earlier documents, so
+        # convert in rounds, finishing the included ones first.
+        while waiting:
+            ready = []
+            for i in waiting:
+                if all(results[int(n)] is not None for n in self.token_re.findall(self.docs[i])):
+                    ready.append(i)
+            if not ready:
+                raise Exception('Markdown batch has unresolvable documents.')
+            texts = [self.resolve(self.docs[i], results) for i in ready]
+            for i, html in zip(ready, md_to_html_batch(texts, self.size)):
+                results[i] = html
+            waiting = [i for i in waiting if results[i] is None]
+        callbacks = self.callbacks
+        self.docs = []
+        self.callbacks = []
+        for f, text in callbacks:
+            f(self.resolve(text, results))
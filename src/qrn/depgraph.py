@@ -0,0 +1,76 @@
+'''Record of the files each output was actually built from.'''
+
+import json
+import logging
+import os
+from pathlib import Path
+
+class DependencyGraph:
+    '''Maps each output path to the extra files (layouts, includes)
+    that went into building it and to the site index queries it made,
+    along with a fingerprint of their results. Saved as json between builds.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}
+        self.pending = {}
+
+    def load(self):
+        '''Load the graph saved by the last build, if there is one.'''
+        if not (self.path and os.path.exists(self.path)):
+            return self
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except ValueError:
+            logging.warning('Ignoring unreadable dependency graph %s', self.path)
+            self.entries = {}
+        return self
+
+    def save(self):
+        '''Write the graph out for the next build.'''
+        if not self.path:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def sources_for(self, output):
+        '''Return the recorded dependencies of output as paths, or None.'''
+        entry = self.entries.get(str(output), None)
+        if entry is None:
+            return None
+        return [Path(s) for s in entry['sources']]
+
+    def queries_for(self, output):
+        '''Return the recorded index queries of output, a list of
+        [name, args, kwargs, fingerprint] lists.'''
+        entry = self.entries.get(str(output), None)
+        if entry is None:
+            return []
+        return entry['queries']
+
+    def record(self, output, sources, queries=[]):
+        '''Record the files and the queries that output was just built from.'''
+        entry = {
+                'sources': sorted(set(str(s) for s in sources)),
+                'queries': list(queries)}
+        self.entries[str(output)] = entry
+        self.pending[str(output)] = entry
+
+    def forget(self, output):
+        '''Drop what is known about output, once it has been removed.'''
+        self.entries.pop(str(output), None)
+
+    def drain(self):
+        '''Return and forget the entries recorded since the last drain.
+        Used to carry the results of worker processes back to the parent.'''
+        pending = self.pending
+        self.pending = {}
+        return pending
+
+    def merge(self, entries):
+        '''Add entries returned by drain.'''
+        self.entries.update(entries)
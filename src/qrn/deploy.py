@@ -0,0 +1,124 @@
+'''What changed in the built site, so that a deploy only has to sync the difference.'''
+
+import json
+import logging
+import os
+from pathlib import Path
+import qrn.components as components
+import qrn.utils as utils
+
+def scan(output_dir, manifest):
+    '''Return {path: {'size': ..., 'sha256': ...}} for every file under
+    output_dir, the paths relative to output_dir. The hashes come from
+    the build manifest, so only new and changed files are read.'''
+    files = {}
+    if not Path(output_dir).is_dir():
+        return files
+    for path in utils.walk(output_dir, include_all=True):
+        if path.is_dir():
+            continue
+        relative = path.relative_to(output_dir).as_posix()
+        files[relative] = {'size': path.stat().st_size, 'sha256': manifest.hash(path)}
+    return files
+
+def changes(old, new):
+    '''Return the sorted (added, changed, removed) paths between two scans.'''
+    added = sorted(p for p in new if p not in old)
+    changed = sorted(p for p in new if p in old and new[p]['sha256'] != old[p]['sha256'])
+    removed = sorted(p for p in old if p not in new)
+    return added, changed, removed
+
+def is_orphan(path, output_dir, manifest):
+    '''Return true if the output at path has nothing left in src to be
+    built from. Outputs the manifest knows about are checked against the
+    source they were built from, the rest against the files that could
+    have turned into them.'''
+    relative = path.relative_to(output_dir)
+    if path.is_dir():
+        return not Path('src', relative).is_dir()
+    entry = manifest.outputs.get(str(path), None)
+    if entry:
+        return not os.path.exists(entry['source'])
+    return not any(p.exists() for p in components.possible_sources(relative))
+
+def find_orphans(output_dir, manifest):
+    '''Return the files and directories under output_dir whose sources
+    have been deleted from src.'''
+    if not Path(output_dir).is_dir():
+        return []
+    paths = utils.walk(output_dir, include_all=True)
+    next(paths)
+    return [p for p in paths if is_orphan(p, output_dir, manifest)]
+
+def prune(orphans, manifest, graph):
+    '''Remove the orphaned outputs and forget them. Directories are
+    only removed once they are empty.'''
+    for path in orphans:
+        if path.is_dir():
+            continue
+        print('Removing orphan', path)
+        os.remove(path)
+        manifest.forget(path)
+        graph.forget(path)
+    for path in reversed(orphans):
+        if path.is_dir():
+            try:
+                path.rmdir()
+                print('Removing orphan', path)
+            except OSError:
+                logging.warning('Orphaned directory %s is not empty.', path)
+
+class DeployManifest:
+    '''The path, size and sha256 of each file in the built site along with
+    the files added, changed and removed since the previous build and the
+    orphaned outputs, those whose sources have been deleted from src.
+    Paths are relative to the output directory.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.orphans = []
+
+    def load(self):
+        '''Load the files from the deploy manifest of the last build.'''
+        if not (self.path and os.path.exists(self.path)):
+            return self
+        try:
+            with open(self.path) as f:
+                self.files = json.load(f)['files']
+        except (ValueError, KeyError):
+            logging.warning('Ignoring unreadable deploy manifest %s', self.path)
+        return self
+
+    def update(self, output_dir, manifest, orphans):
+        '''Scan output_dir and work out what changed since the last scan.'''
+        files = scan(output_dir, manifest)
+        self.added, self.changed, self.removed = changes(self.files, files)
+        self.files = files
+        self.orphans = sorted(p.relative_to(output_dir).as_posix() for p in orphans)
+
+    def save(self):
+        if not self.path:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        data = {
+                'files': self.files,
+                'added': self.added,
+                'changed': self.changed,
+                'removed': self.removed,
+                'orphans': self.orphans}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def stats(self):
+        return {
+                'files': len(self.files),
+                'added': len(self.added),
+                'changed': len(self.changed),
+                'removed': len(self.removed),
+                'orphans': len(self.orphans)}
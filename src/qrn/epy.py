@@ -25,11 +25,13 @@ def _compile_template(fragments):
         if not CODE_RE.search(frag):
             generator.text(frag)
         elif ESCAPE_RE.search(frag):
-            logging.debug('escape: %s', frag)
+            if utils.DEBUG:
+                logging.debug('escape: %s', frag)
             generator.text('<%')
             generator.text(frag[3:])
         elif END_ESCAPE.search(frag):
-            logging.debug('end escape: %s', frag)
+            if utils.DEBUG:
+                logging.debug('end escape: %s', frag)
             generator.text('%>')
         elif END_RE.search(frag):
             generator.dedent()
@@ -59,6 +61,7 @@ def source_code_for(ttext):
 
 def template_from_text(ttext, desc='template'):
     '''Given some template text, return the corresponding compiled Python code.'''
+    utils.update_log_level()
     output = source_code_for(ttext)
     code = utils.compile_string(output, desc)
     return code
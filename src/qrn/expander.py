@@ -1,17 +1,83 @@
 '''Key code of QRN, takes a file and expands it to output.'''
 
+import hashlib
+import json
 import logging
 from pathlib import Path
 import xml.etree.ElementTree as ET
+import qrn.records as records
 import qrn.utils as utils
-import qrn.epy as epy
-import qrn.paml as paml
 import qrn.converters as converters
 import qrn.rss as rss
+from qrn.template_cache import TemplateCache
+
+def index_query(f):
+    '''Decorator for the helpers that read the site index. Each call is
+    recorded along with a fingerprint of the result so that the next
+    build can tell if the page would now see something different.'''
+    name = f.__name__
+    def _index_query(self, *args, **kwargs):
+        result = f(self, *args, **kwargs)
+        self.record_query(name, args, kwargs, result)
+        return result
+    _index_query.__name__ = name
+    _index_query.__doc__ = f.__doc__
+    return _index_query
+
+def _replayable(args, kwargs):
+    '''Return true if the query arguments survive a trip through json.'''
+    try:
+        return json.loads(json.dumps([args, kwargs])) == [list(args), kwargs]
+    except (TypeError, ValueError):
+        return False
 
 class Helpers:
     '''Helper functions for expanding QRN files.'''
 
+    queries = None
+
+    def record_query(self, name, args, kwargs, result):
+        if self.queries is None:
+            return
+        if _replayable(args, kwargs):
+            fingerprint = self.fingerprint(result)
+        else:
+            fingerprint = None
+        self.queries.append([name, list(args), kwargs, fingerprint])
+
+    def fingerprint(self, result):
+        '''Return a hash identifying the pages returned by an index query.'''
+        if result is None or isinstance(result, dict):
+            result = [result]
+        page_records = self.page['site'].get('records', None) or {}
+        hasher = hashlib.sha256()
+        for page in result:
+            if not page:
+                hasher.update(b'none\n')
+                continue
+            record = page_records.get(page.get('ipath', None), None)
+            if record:
+                digest = record.header_digest()
+            else:
+                digest = records.digest(page)
+            hasher.update(f'{page.get("url", None)} {digest}\n'.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def queries_changed(self, queries):
+        '''Return true if any of the recorded queries now gives a different result.'''
+        for name, args, kwargs, fingerprint in queries:
+            if fingerprint is None:
+                return True
+            try:
+                result = getattr(self, name)(*args, **kwargs)
+            except Exception as e:
+                logging.info('Query %s%s now fails: %s', name, args, e)
+                return True
+            if self.fingerprint(result) != fingerprint:
+                logging.info('Query %s%s has a new result.', name, args)
+                return True
+        return False
+
     def __filter_pages(self, pages, n):
         url = self.page['url']
         candidates = pages[:n+1]
@@ -30,6 +96,7 @@ class Helpers:
         result = rss.to_rss_str(self.page['site'], url, pages)
         return result
 
+    @index_query
     def related(self, n=3):
         category = self.page.get('category', None)
         if not category:
@@ -40,17 +107,23 @@ class Helpers:
             pages = by_category[category]
             return list(self.__filter_pages(pages, n))
 
+    @index_query
     def articles(self, n=999999):
         site = self.page['site']
         all_articles = site['articles']
         return self.__filter_pages(all_articles, n)
 
     def sort_by(self, alist, fieldname, default=None, reverse=False):
-        result = alist.copy()
-        result.sort(
-                key=lambda a: a.get(fieldname, default),
-                reverse=reverse)
-        logging.debug("sorted by %s: %s", fieldname, result)
+        index = self.page['site'].get('index', None)
+        if index:
+            result = index.sorted(alist, fieldname, default, reverse)
+        else:
+            result = alist.copy()
+            result.sort(
+                    key=lambda a: a.get(fieldname, default),
+                    reverse=reverse)
+        if utils.DEBUG:
+            logging.debug("sorted %d pages by %s", len(result), fieldname)
         return result
 
     def anchor_for_page(self, page, text=None):
@@ -59,24 +132,34 @@ class Helpers:
             text = page.get('title', 'No title')
         return self.__make_anchor(url, text)
 
+    @index_query
     def find_page_by_id(self, identifier):
         site = self.page['site']
+        index = site.get('index', None)
+        if index:
+            return index.first('id', identifier)
         all_pages = site['all_pages']
         return next((p for p in all_pages if p.get('id', None) ==  identifier), None)
 
+    @index_query
     def find_pages(self, *kvs):
         if (len(kvs) % 2) == 1:
-            logging.error("Odd number of value: %s", nvs)
+            logging.error("Odd number of value: %s", kvs)
             raise Exception("find_pages: You must supply a value for each attribute.")
         site = self.page['site']
+        index = site.get('index', None)
+        if index:
+            return index.find(*kvs)
         pages = site['all_pages']
         pairs = utils.partition(kvs, 2)
         for pair in pairs:
-            logging.debug('pair: %s', pair)
+            if utils.DEBUG:
+                logging.debug('pair: %s', pair)
             name = pair[0]
             value = pair[1]
             pages = list(filter(lambda page: page.get(name,None) == value, pages))
-            logging.debug("filtered pages: %s", len(pages))
+            if utils.DEBUG:
+                logging.debug("filtered pages: %s", len(pages))
         return list(pages)
 
     def find_page(self, *kvs):
@@ -124,19 +207,57 @@ class Helpers:
         env['self'] = self
 
 class Expander(Helpers):
-    code_cache = {}
+    template_cache = TemplateCache()
+    markdown_batch = None
+    fragment_cache = None
 
-    def __init__(self, inc_dir, path, page):
+    def __init__(self, inc_dir, path, page, record=None):
         self.inc_dir = inc_dir
         self.path = path
         self.page = page
-     
+        self.record = record
+        self.dependencies = set()
+        self.queries = []
+
     def include(self, path, full_path=False):
         '''Process a file include.'''
         if not full_path:
             path = Path(self.inc_dir, path)
-        page, body = utils.read_structured(path)
-        return self.__do_expand(path, body, page) 
+        if path != self.path:
+            self.dependencies.add(path)
+        if self.record and path == self.path:
+            page = utils.EasyDict(self.record.header)
+            body = self.record.read_body()
+        else:
+            page, body = utils.read_structured(path)
+        key = self.fragment_cache and self.fragment_cache.key(path, page, self.page)
+        if not key:
+            return self.__do_expand(path, body, page)
+        entry = self.fragment_cache.get(key)
+        if entry is None:
+            return self.__expand_fragment(key, path, body, page)
+        text, dependencies, queries = entry
+        self.dependencies |= dependencies
+        self.queries.extend(queries)
+        return text
+
+    def __expand_fragment(self, key, path, body, page):
+        '''Expand a cacheable include, noting the files and queries it used.'''
+        dependencies = self.dependencies
+        queries = self.queries
+        self.dependencies = set()
+        self.queries = []
+        try:
+            text = self.__do_expand(path, body, page)
+            # Markdown waiting in a batch can't be reused once the batch is flushed.
+            if not (self.markdown_batch and self.markdown_batch.has_tokens(text)):
+                self.fragment_cache.put(key, text, self.dependencies, self.queries)
+            return text
+        finally:
+            dependencies |= self.dependencies
+            queries.extend(self.queries)
+            self.dependencies = dependencies
+            self.queries = queries
 
     def expand(self):
         '''Expand a single page, dealing with the layout if any.'''
@@ -145,7 +266,10 @@ class Expander(Helpers):
             return self.include(self.page['layout'])
         else:
             logging.debug('No layout for page %s.', self.path)
-            body = utils.read_body(self.path)
+            if self.record:
+                body = self.record.read_body()
+            else:
+                body = utils.read_body(self.path)
             return self.__do_expand(self.path, body, self.page)
 
     def __do_expand(self, path, text, env):
@@ -153,16 +277,21 @@ class Expander(Helpers):
         self.add_locals(env)
         return self.__eval_text(path, text, env)
 
+    def __convert_markdown(self, content):
+        if self.markdown_batch:
+            return self.markdown_batch.add(content)
+        return converters.md_to_html(content)
+
     def __eval_text(self, path, text, env):
         if path.suffix == '.md':
-            code = epy.template_from_text(text, path)
+            code = self.template_cache.compile(path, text, 'epy')
             content = utils.exec_prog_output(code, loc=env)
-            content = converters.md_to_html(content)
+            content = self.__convert_markdown(content)
         elif path.suffix in ['.xml', '.html']:
-            code = epy.template_from_text(text, path)
+            code = self.template_cache.compile(path, text, 'epy')
             content = utils.exec_prog_output(code, loc=env)
         elif path.suffix == '.haml':
-            code = paml.template_from_text(text, path)
+            code = self.template_cache.compile(path, text, 'paml')
             content = utils.exec_prog_output(code, loc=env)
         else:
             raise(Exception(f'Dont know what to do with {path}'))
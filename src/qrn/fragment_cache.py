@@ -0,0 +1,77 @@
+'''Cache of rendered includes, for partials that are the same on many pages.'''
+
+import logging
+import qrn.records as records
+
+def cache_inputs(header):
+    '''Return the page attributes an include says its output depends on,
+    or None if it isn't cacheable. The include declares them in its
+    header with cache: site (none), cache: attr or cache: [attr, ...].'''
+    declared = header.get('cache', None)
+    if declared is None or declared is False:
+        return None
+    if declared == 'site':
+        return []
+    if isinstance(declared, str):
+        return [declared]
+    if isinstance(declared, list) and all(isinstance(a, str) for a in declared):
+        return declared
+    raise Exception(f'Bad cache value in include header: {declared}')
+
+class FragmentCache:
+    '''The rendered output of cacheable includes, keyed by the include and
+    the values of the page attributes it depends on. Each entry also
+    keeps the files and index queries that went into the output, so the
+    pages that reuse it depend on them too. Only good for a single build.'''
+
+    def __init__(self):
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.drained_entries = 0
+        self.totals = {'hits': 0, 'misses': 0, 'entries': 0}
+
+    def key(self, path, header, page):
+        '''Return the cache key for including path into page, or None.'''
+        attrs = cache_inputs(header)
+        if attrs is None:
+            return None
+        values = [page.get(a, None) for a in attrs]
+        return (str(path), records.digest([attrs, values]))
+
+    def get(self, key):
+        '''Return the (text, dependencies, queries) stored under key, or None.'''
+        entry = self.entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            logging.debug('Fragment cache miss: %s', key[0])
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, text, dependencies, queries):
+        self.entries[key] = (text, set(dependencies), list(queries))
+
+    def drain(self):
+        '''Return and forget the counts since the last drain. Used to carry
+        the counts of worker processes, each with a cache of its own, back
+        to the parent.'''
+        counts = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.entries) - self.drained_entries}
+        self.hits = self.misses = 0
+        self.drained_entries = len(self.entries)
+        return counts
+
+    def merge(self, counts):
+        '''Add counts returned by drain.'''
+        for k, v in counts.items():
+            self.totals[k] += v
+
+    def stats(self):
+        '''Return a dictionary of the cache counters.'''
+        return {
+                'hits': self.totals['hits'] + self.hits,
+                'misses': self.totals['misses'] + self.misses,
+                'entries': self.totals['entries'] + len(self.entries) - self.drained_entries}
@@ -0,0 +1,137 @@
+'''Content hashes of the files that went into and came out of a build.'''
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+def hash_file(path):
+    '''Return the hex sha256 of the contents of a file.'''
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+class BuildManifest:
+    '''Remembers the hash of each output and the hashes of the sources it
+    was built from, so that staleness can be decided by content rather
+    than by mtime. Hashes are cached along with each file's (mtime, size,
+    inode) and a file is only rehashed when those change.'''
+
+    def __init__(self, path=None):
+        self.path = path
+        self.files = {}
+        self.outputs = {}
+        self.pending_files = {}
+        self.pending_outputs = {}
+        self.unhashed = []
+
+    def load(self):
+        '''Load the manifest saved by the last build, if there is one.'''
+        if not (self.path and os.path.exists(self.path)):
+            return self
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.files = data['files']
+            self.outputs = data['outputs']
+        except (ValueError, KeyError):
+            logging.warning('Ignoring unreadable build manifest %s', self.path)
+        return self
+
+    def save(self):
+        '''Write the manifest out for the next build.'''
+        if not self.path:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'files': self.files, 'outputs': self.outputs}, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def hash(self, path):
+        '''Return the hash of the file at path, or None if it doesn't exist.'''
+        key = str(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stamp = [st.st_mtime_ns, st.st_size, st.st_ino]
+        entry = self.files.get(key, None)
+        if entry and entry['stamp'] == stamp:
+            return entry['sha256']
+        entry = {'stamp': stamp, 'sha256': hash_file(path)}
+        self.files[key] = entry
+        self.pending_files[key] = entry
+        return entry['sha256']
+
+    def knows(self, output):
+        return str(output) in self.outputs
+
+    def is_outdated(self, output, sources):
+        '''Return true if output is missing or has been changed since it was
+        built, or if the set of sources or any of their contents has changed.'''
+        entry = self.outputs.get(str(output), None)
+        if not entry:
+            return True
+        current = self.hash(output)
+        if current is None:
+            logging.info('Output %s is missing.', output)
+            return True
+        if current != entry['sha256']:
+            logging.info('Output %s has changed since it was built.', output)
+            return True
+        source_hashes = entry['sources']
+        if set(str(s) for s in sources) != set(source_hashes):
+            logging.info('Output %s has a different set of sources.', output)
+            return True
+        for s in sources:
+            if self.hash(s) != source_hashes[str(s)]:
+                logging.info('Output %s is out of date wrt %s.', output, s)
+                return True
+        return False
+
+    def forget(self, output):
+        '''Drop what is known about output, once it has been removed.'''
+        self.outputs.pop(str(output), None)
+        self.files.pop(str(output), None)
+
+    def record(self, output, sources):
+        '''Record the hashes of the sources output was just built from,
+        the first of which is the file it was made from. The hash of the
+        output itself is taken by drain, since the output may not be
+        written until the end of a markdown batch.'''
+        hashes = {str(s): self.hash(s) for s in sources}
+        self.outputs[str(output)] = {
+                'sha256': None,
+                'source': str(sources[0]),
+                'sources': hashes}
+        self.unhashed.append(str(output))
+
+    def abandon(self):
+        '''Forget the outputs recorded but not yet hashed, which may never
+        have been written if the build failed before drain.'''
+        for output in self.unhashed:
+            self.outputs.pop(output, None)
+        self.unhashed = []
+
+    def drain(self):
+        '''Hash the newly built outputs, then return and forget the entries
+        recorded since the last drain. Used to carry the results of worker
+        processes back to the parent.'''
+        for output in self.unhashed:
+            entry = self.outputs[output]
+            entry['sha256'] = self.hash(output)
+            self.pending_outputs[output] = entry
+        self.unhashed = []
+        pending = {'files': self.pending_files, 'outputs': self.pending_outputs}
+        self.pending_files = {}
+        self.pending_outputs = {}
+        return pending
+
+    def merge(self, pending):
+        '''Add entries returned by drain.'''
+        self.files.update(pending['files'])
+        self.outputs.update(pending['outputs'])
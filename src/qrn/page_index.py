@@ -0,0 +1,115 @@
+'''Queryable index of the pages of a site.'''
+
+import logging
+
+DEFAULT_ATTRS = ('id', 'url', 'kind', 'category')
+
+def _hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+def _sort(pages, fieldname, default, reverse):
+    result = list(pages)
+    result.sort(key=lambda p: p.get(fieldname, default), reverse=reverse)
+    return result
+
+class PageIndex:
+    '''Hash indexes on page attributes over a list of pages.
+
+    The id, url, kind and category attributes are always indexed, along
+    with any extra attrs. Other attributes are indexed the first time
+    they are queried. Query results keep the order of the page list.'''
+
+    def __init__(self, pages, attrs=()):
+        self.pages = pages
+        self.attrs = list(DEFAULT_ATTRS) + [a for a in attrs if a not in DEFAULT_ATTRS]
+        self.rebuild()
+
+    def rebuild(self):
+        '''Recompute all of the indexes, call after changing the page list.'''
+        self.position = {id(p): i for i, p in enumerate(self.pages)}
+        self.indexes = {}
+        self.unhashable = {}
+        self.sorted_views = {}
+        for name in self.attrs:
+            self.__index(name)
+
+    def __index(self, name):
+        logging.debug('Indexing pages by %s', name)
+        index = {}
+        unhashable = []
+        for page in self.pages:
+            value = page.get(name, None)
+            if _hashable(value):
+                index.setdefault(value, []).append(page)
+            else:
+                unhashable.append(page)
+        self.indexes[name] = index
+        self.unhashable[name] = unhashable
+
+    def lookup(self, name, value):
+        '''Return the pages whose name attribute equals value.'''
+        if not _hashable(value):
+            return [p for p in self.pages if p.get(name, None) == value]
+        if name not in self.indexes:
+            self.__index(name)
+        result = self.indexes[name].get(value, [])
+        odd_ones = [p for p in self.unhashable[name] if p.get(name, None) == value]
+        if odd_ones:
+            result = sorted(result + odd_ones, key=lambda p: self.position[id(p)])
+        return result
+
+    def find(self, *kvs):
+        '''Return the pages matching all of the attribute, value pairs.'''
+        if not kvs:
+            return list(self.pages)
+        matches = [self.lookup(kvs[i], kvs[i+1]) for i in range(0, len(kvs), 2)]
+        matches.sort(key=len)
+        result = matches[0]
+        for other in matches[1:]:
+            ids = set(id(p) for p in other)
+            result = [p for p in result if id(p) in ids]
+        return list(result)
+
+    def first(self, name, value):
+        '''Return the first page whose name attribute equals value, or None.'''
+        pages = self.lookup(name, value)
+        if pages:
+            return pages[0]
+        return None
+
+    def sorted(self, pages, fieldname, default=None, reverse=False):
+        '''Return a copy of pages sorted by fieldname.
+
+        The sort of the whole page list is cached for each set of sort
+        arguments. A good sized list of pages that are in page list order,
+        like the articles or a category, is sorted by picking its pages
+        out of that, which gives the same order as sorting it directly.'''
+        if len(pages) * 4 < len(self.pages) or not self.__in_order(pages):
+            return _sort(pages, fieldname, default, reverse)
+        key = (fieldname, repr(default), reverse)
+        view = self.sorted_views.get(key, None)
+        if view is None:
+            try:
+                view = _sort(self.pages, fieldname, default, reverse)
+            except TypeError:
+                # Some page outside of pages can't be compared.
+                return _sort(pages, fieldname, default, reverse)
+            self.sorted_views[key] = view
+        if len(pages) == len(view):
+            return list(view)
+        ids = set(id(p) for p in pages)
+        return [p for p in view if id(p) in ids]
+
+    def __in_order(self, pages):
+        '''Return true if pages are all indexed and in page list order.'''
+        last = -1
+        for p in pages:
+            i = self.position.get(id(p), None)
+            if i is None or i <= last:
+                return False
+            last = i
+        return True
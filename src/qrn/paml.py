@@ -13,9 +13,9 @@ EOF = utils.Special('eof')
 SPACING = 2
 
 def indent_level(s):
-    for n in range(len(s)):
-        if (s[n] != ' '):
-            return [n / SPACING, s[n:]]
+    text = s.lstrip(' ')
+    if text:
+        return [(len(s) - len(text)) / SPACING, text]
 
 class PamlParser:
     '''Parse the HAML-like Paml text.'''
@@ -47,7 +47,8 @@ class PamlParser:
             line = self.lines[self.iline]
             self.iline += 1
             line = line.rstrip()
-            logging.debug('New line: [%s]', line)
+            if utils.DEBUG:
+                logging.debug('New line: [%s]', line)
             this_depth, line = indent_level(line)
             while this_depth > self.depth:
                 self.tokens.append(INDENT)
@@ -62,7 +63,8 @@ class PamlParser:
         if self.itoken >= len(self.tokens):
             return EOF
         result = self.tokens[self.itoken]
-        logging.debug("Paml read token %s", result)
+        if utils.DEBUG:
+            logging.debug("Paml read token %s", result)
         self.itoken += 1
         return result
 
@@ -84,10 +86,12 @@ class PamlParser:
     def read_collection(self):
         result = []
         tok = self.read_token()
-        logging.debug("reading collection %s", tok)
+        if utils.DEBUG:
+            logging.debug("reading collection %s", tok)
         while tok != OUTDENT and (tok != EOF):
             self.unread_token()
-            logging.debug("reading collection %s", tok)
+            if utils.DEBUG:
+                logging.debug("reading collection %s", tok)
             expr = self.read_node()
             result.append(expr)
             tok = self.read_token()
@@ -120,6 +124,7 @@ class PamlParser:
 
 def template_from_text(text, desc='template'):
     '''Return the Python compiled code for the Paml text.'''
+    utils.update_log_level()
     lines = text.split('\n')
     parser = PamlParser(lines)
     generator = CodeGenerator()
@@ -127,7 +132,8 @@ def template_from_text(text, desc='template'):
     while node:
         node.expand(generator)
         node = parser.read_node()
-    logging.debug("template from text, len of gen output %s", len(generator.output))
-    code = utils.compile_string(generator.output, desc)
-    logging.debug("code: %s", code)
-    return code
+    output = generator.output
+    if utils.DEBUG:
+        logging.debug("template from text, len of gen output %s", len(output))
+        utils.log_code(output)
+    return utils.compile_string(output, desc)
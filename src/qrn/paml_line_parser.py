@@ -7,6 +7,8 @@ class PamlLineParser:
 
     BR = re.compile('^ *\{')
     ACE = re.compile('\} *$')
+    WORD = re.compile(r'[\w\-]*')
+    ESCAPE = re.compile(r'\\(.)')
 
     def __init__(self, text):
         self.text = text
@@ -33,23 +35,16 @@ class PamlLineParser:
         return self.text[self.ichar:]
 
     def get_word(self):
-        result = ''
-        ch = self.getc()
-        while ch and re.match(r'[\w\-]', ch):
-            result += ch
-            ch = self.getc()
-        self.backup()
-        return result
+        m = self.WORD.match(self.text, self.ichar)
+        self.ichar = m.end()
+        return m.group()
 
     def get_attrs(self):
-        result = '{'
-        ch = self.getc()
-        while ch and ch != '}':
-            result += ch
-            ch = self.getc()
-        if ch != '}':
-            print(f"Error: unclosed brace in {result}")
-        result += ch
+        end = self.text.find('}', self.ichar)
+        if end < 0:
+            raise Exception(f'Unclosed brace in: {self.text}')
+        result = '{' + self.text[self.ichar:end+1]
+        self.ichar = end + 1
         return result
 
     def parse(self):
@@ -85,7 +80,7 @@ class PamlLineParser:
         return paml_node.ExpressionNode(text)
 
     def process_text(self, text):
-        text = re.sub(r'\\(.)', r'\g<1>', text)
+        text = self.ESCAPE.sub(r'\g<1>', text)
         return text
 
     def parse_element(self):
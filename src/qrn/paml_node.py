@@ -1,16 +1,45 @@
 import re
 import logging
+import qrn.utils as utils
+
+class TextCollector:
+    '''Stands in for a CodeGenerator when expanding static nodes,
+    keeping the text instead of generating code for it.'''
+    def __init__(self):
+        self.parts = []
+
+    def text(self, text, line_no=None):
+        self.parts.append(text)
+
+    def result(self):
+        return ''.join(self.parts)
 
 class PamlNode:
     '''Generic Paml parse tree node.'''
     def __init__(self):
         self.children = []
+        self.static = None
+
+    def is_static(self):
+        '''Return true if the node and its children produce fixed text.
+        Worked out once, the first time it's asked, so call it only once
+        the tree is complete.'''
+        if self.static is None:
+            self.static = self._is_static_node() and all(
+                    kid.is_static() for kid in self.children)
+        return self.static
+
+    def _is_static_node(self):
+        '''Return true if the node itself, leaving out its children, produces fixed text.'''
+        return True
 
     def add_child(self, kid):
         self.children.append(kid)
+        self.static = None
 
     def add_all(self, kids):
-        logging.debug("Add all: %s", kids)
+        if utils.DEBUG:
+            logging.debug("Add all: %s", kids)
         for k in kids:
             self.add_child(k)
 
@@ -56,8 +85,21 @@ class ElementNode(PamlNode):
         else:
             generator.text(self.text)
 
+    def _is_static_node(self):
+        return not self.eval_text
+
     def expand(self, generator):
-        logging.debug('Compile <%s> %s', self.tag, self.text)
+        if utils.DEBUG:
+            logging.debug('Compile <%s> %s', self.tag, self.text)
+        if self.is_static() and not isinstance(generator, TextCollector):
+            # Render the whole subtree now, it will be the same every time.
+            collector = TextCollector()
+            self.expand_element(collector)
+            generator.text(collector.result())
+        else:
+            self.expand_element(generator)
+
+    def expand_element(self, generator):
         generator.text(f'<{self.tag}')
         self._expand_attrs(generator)
 
@@ -79,7 +121,8 @@ class ElementNode(PamlNode):
 class ContentNode(PamlNode):
     '''Paml node that represents some text.'''
     def __init__(self, text):
-        logging.debug("New content node: %s", text)
+        if utils.DEBUG:
+            logging.debug("New content node: %s", text)
         super().__init__()
         self.text = text
 
@@ -98,12 +141,17 @@ class ExpressionNode(PamlNode):
     '''A Python expression embedded in some paml.'''
 
     def __init__(self, text):
-        logging.debug("New expr node: %s", text)
+        if utils.DEBUG:
+            logging.debug("New expr node: %s", text)
         super().__init__()
         self.text = text
 
+    def _is_static_node(self):
+        return False
+
     def expand(self, generator):
-        logging.debug("Compile: %s", self.text)
+        if utils.DEBUG:
+            logging.debug("Compile: %s", self.text)
         generator.expr(self.text)
         self._expand_children(generator)
 
@@ -111,12 +159,14 @@ class CommentNode(PamlNode):
     '''A Paml comment.'''
 
     def __init__(self, text):
-        logging.debug("New comment node: %s", text)
+        if utils.DEBUG:
+            logging.debug("New comment node: %s", text)
         super().__init__()
         self.text = text
 
     def expand(self, generator):
-        logging.debug("Compile comment: %s", self.text)
+        if utils.DEBUG:
+            logging.debug("Compile comment: %s", self.text)
         generator.text('<!-- ')
         generator.text(self.text)
         self._expand_children(generator)
@@ -126,12 +176,17 @@ class CommandNode(PamlNode):
     '''A Paml node for some arbitrary Python code.'''
 
     def __init__(self, text):
-        logging.debug("New command node: %s", text)
+        if utils.DEBUG:
+            logging.debug("New command node: %s", text)
         super().__init__()
         self.text = text
 
+    def _is_static_node(self):
+        return False
+
     def expand(self, generator):
-        logging.debug("Compile command: %s", self.text)
+        if utils.DEBUG:
+            logging.debug("Compile command: %s", self.text)
         generator.code(self.text)
 
         if START_RE.match(self.text):
@@ -1,16 +1,23 @@
 from pathlib import Path
 import glob
+import logging
+import multiprocessing
 import shutil
 import os.path
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from enum import Enum
+import qrn.timing as timing
 import qrn.utils as utils
 
 NOT_APPLICABLE=utils.Special('NA')
 COMPLETE=utils.Special('CO')
 
 def build_rule(rule, context):
+    if timing.timings:
+        return _timed_build_rule(rule, context)
     for f in rule:
         result = f(context)
         if result in [NOT_APPLICABLE, COMPLETE]:
@@ -18,6 +25,15 @@ def build_rule(rule, context):
         context = result
     return context
 
+def _timed_build_rule(rule, context):
+    source = context
+    for f in rule:
+        result = timing.timed_step(f, context, source)
+        if result in [NOT_APPLICABLE, COMPLETE]:
+            return result
+        context = result
+    return context
+
 def build_rule_f(rule):
     def _build_rule(context):
         return build_rule(rule, context)
@@ -34,9 +50,87 @@ def build(rules, context):
 def build_f(rules):
     return partial(build, rules)
 
-def build_all(rules, contexts):
+def build_all(rules, contexts, jobs=1, finish=None, merge=None):
+    """Build each of the contexts. With jobs > 1 the contexts are
+    built in parallel by a pool of worker processes.
+
+    If supplied, finish is called with no arguments once the contexts
+    are built, in the worker processes when building in parallel.
+    Whatever finish returns is handed to merge in the calling process."""
+    if jobs > 1:
+        return build_all_parallel(rules, contexts, jobs, finish, merge)
+    result = True
     for c in contexts:
         result = build(rules, c)
         if not result:
             return False
+    if finish:
+        finished = finish()
+        if merge:
+            merge(finished)
     return result
+
+# The rules and finish function for the worker processes. Closures
+# can't be pickled, so the workers are forked and inherit these.
+_parallel_rules = None
+_parallel_finish = None
+
+def _build_chunk(contexts):
+    """Build some contexts in a worker, returning a list of failures
+    and the result of the finish function."""
+    failures = []
+    for c in contexts:
+        try:
+            if not build(_parallel_rules, c):
+                failures.append((str(c), 'No rule applies'))
+        except Exception as e:
+            logging.exception('Build failed: %s', c)
+            failures.append((str(c), repr(e)))
+    finished = None
+    if _parallel_finish:
+        try:
+            finished = _parallel_finish()
+        except Exception as e:
+            logging.exception('Build failed finishing up')
+            failures.append(('finish', repr(e)))
+    return failures, finished
+
+def build_all_parallel(rules, contexts, jobs, finish=None, merge=None):
+    """Build the contexts with a pool of jobs worker processes.
+
+    A failure doesn't stop the build, instead every failed context
+    is reported at the end and the result is False."""
+    global _parallel_rules, _parallel_finish
+    try:
+        mp_context = multiprocessing.get_context('fork')
+    except ValueError:
+        logging.warning('Cannot fork worker processes, building sequentially.')
+        return build_all(rules, contexts, 1, finish, merge)
+
+    contexts = list(contexts)
+    chunk_size = max(1, len(contexts) // (jobs * 4))
+    chunks = list(utils.partition(contexts, chunk_size))
+    logging.info('Building %d items in %d chunks with %d jobs.', len(contexts), len(chunks), jobs)
+
+    _parallel_rules = rules
+    _parallel_finish = finish
+    # Don't let the workers inherit (and repeat) buffered output.
+    sys.stdout.flush()
+    sys.stderr.flush()
+    failures = []
+    try:
+        with ProcessPoolExecutor(jobs, mp_context=mp_context) as pool:
+            for chunk_failures, finished in pool.map(_build_chunk, chunks):
+                failures += chunk_failures
+                # A worker whose finish failed has nothing to merge,
+                # the failure is already in chunk_failures.
+                if merge and finished is not None:
+                    merge(finished)
+    finally:
+        _parallel_rules = None
+        _parallel_finish = None
+
+    for name, error in failures:
+        logging.error('Failed: %s: %s', name, error)
+        print('Failed:', name, error)
+    return not failures
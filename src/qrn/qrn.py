@@ -3,40 +3,83 @@
 from pathlib import Path
 import logging
 import datetime
+import time
 import qrn.pipeline as pl
 import qrn.components as components
 import qrn.converters as converters
+import qrn.deploy as deploy
+import qrn.records as records
 import qrn.rss as rss
+import qrn.timing as timing
 import qrn.utils as utils
 
+from qrn.assets import AssetCopier
+from qrn.cache import DiskCache
+from qrn.depgraph import DependencyGraph
 from qrn.expander import Expander
+from qrn.fragment_cache import FragmentCache
+from qrn.manifest import BuildManifest
+from qrn.page_index import PageIndex
 
-def compute_text(ipath, page):
+CACHE_DIR = '.qrn-cache'
+MARKDOWN_CACHE_BYTES = 256 * 1024 * 1024
+
+# One line summaries of each build are logged here.
+summary = logging.getLogger('qrn.summary')
+
+def log_summary_only():
+    """Cut logging down to warnings, errors and the build summaries,
+    leaving out the line or two per file. Call after configuring logging."""
+    logging.getLogger().setLevel(logging.WARNING)
+    summary.setLevel(logging.INFO)
+
+def compute_text(ipath, page, record=None):
     """Compute the html resulting from expanding ipath."""
-    expander = Expander('src/_layouts', ipath, page)
+    expander = Expander('src/_layouts', ipath, page, record)
     return expander.expand()
 
-def build_html(context):
-    """Build html from the source file."""
+def expand_page(context):
+    """Expand the source file, noting the files it depended on."""
     ipath = context['sources'][0]
     page = context['attrs']
-    context['text'] = compute_text(ipath, page)
+    expander = Expander('src/_layouts', ipath, page, context.get('record', None))
+    context['text'] = expander.expand()
+    context['dependencies'] = expander.dependencies
+    context['queries'] = expander.queries
     return context
 
+def build_html(context):
+    """Build html from the source file."""
+    return expand_page(context)
+
 def build_xml(context):
     """Build xml from the source file."""
-    ipath = context['sources'][0]
-    page = context['attrs']
-    context['text'] = compute_text(ipath, page)
-    return context
+    return expand_page(context)
 
 def write_text(context):
     """Write the text from the context to the output file."""
-    opath = context['output']
-    text = context['text']
-    logging.debug('Writing text to %s', opath)
-    utils.write_file(text, opath)
-    return context
+    return write_text_f(None)(context)
+
+def write_text_f(manifest):
+    """Return a pipeline function like write_text that doesn't rewrite
+    outputs that haven't changed, using the hashes in the build manifest
+    to tell when it can."""
+    def _write(text, opath):
+        current_hash = manifest.hash(opath) if manifest else None
+        utils.write_file(text, opath, compare=True, current_hash=current_hash)
+
+    def _write_text(context):
+        opath = context['output']
+        text = context['text']
+        batch = Expander.markdown_batch
+        if batch and batch.has_tokens(text):
+            logging.debug('Waiting on markdown for %s', opath)
+            batch.later(lambda t: _write(t, opath), text)
+            return context
+        logging.debug('Writing text to %s', opath)
+        _write(text, opath)
+        return context
+    return _write_text
 
 def build_css(context):
     """Create the output css file from the input file."""
@@ -45,6 +88,20 @@ def build_css(context):
     converters.sass_to_css(ipath, opath)
     return context
 
+def build_css_f(batch):
+    """Return a pipeline function that queues the css conversion in a SassBatch."""
+    def _build_css(context):
+        batch.add(context['sources'][0], context['output'], context.get('dependencies', []))
+        return context
+    return _build_css
+
+def find_sass_dependencies(context):
+    """Add the files the stylesheet loads to its sources."""
+    dependencies = converters.sass_dependencies(context['sources'][0])
+    context['sources'] = context['sources'][:1] + dependencies
+    context['dependencies'] = dependencies
+    return context
+
 def set_url(context):
     """Set the url in the context based on the output path."""
     opath = context['output']
@@ -65,6 +122,23 @@ def insert_attr_f(*args):
         return context
     return insert_attr
 
+def isoutdated_f(graph, manifest=None):
+    """Return a pipeline function that checks whether the output is out of
+    date, either because a source file is newer or because one of the
+    site index queries the page made last time now has a different result."""
+    def _isoutdated(context):
+        if components.sources_outdated(context, manifest):
+            return context
+        queries = graph.queries_for(context['output'])
+        if queries:
+            expander = Expander('src/_layouts', context['sources'][0], context['attrs'])
+            if expander.queries_changed(queries):
+                logging.info('Ouput file %s is out of date wrt the site index.', context['output'])
+                return context
+        logging.info('Up to date: %s', context['output'])
+        return pl.COMPLETE
+    return _isoutdated
+
 def debug_f(msg):
     """Return a function that logs pipeline paths with a message"""
     def gen_debug_msg(context):
@@ -88,11 +162,14 @@ def sort_by_date(pages):
 def sort_by(pages, fieldname, default=None, reverse=False):
     return pages.sort(key=lambda p: p.get(fieldname, default), reverse=reverse)
 
-def build_indices(output_dir='build'):
-    """Compute the category and url indices."""
+def build_indices(output_dir='build', index_attrs=()):
+    """Compute the category and url indices, along with a PageIndex
+    that also indexes the pages by any of the index_attrs."""
+    utils.update_log_level()
     by_url = {}
     by_category = {}
     all_pages = []
+    page_records = {}
 
     def index_by_url(context):
         opath = context['output']
@@ -117,7 +194,7 @@ def build_indices(output_dir='build'):
     rule = [
             is_html_src,
             components.to_dependency_f(output_dir, '.html'),
-            components.read_attrs,
+            components.read_record_f(page_records),
             components.ispublished,
             set_url,
             collect_page,
@@ -126,9 +203,10 @@ def build_indices(output_dir='build'):
             utils.always(pl.COMPLETE)
             ]
 
-    paths = utils.match_pats('src/*', 'src/**/*')
+    paths = utils.walk('src')
     pl.build_all([rule, [utils.always(pl.COMPLETE)]], paths)
 
+    summary.info('Indexed %d pages.', len(all_pages))
     sort_by(all_pages, 'date', EARLY, True)
     articles = list(filter(lambda p: p.get('kind', '') == 'article', all_pages))
 
@@ -140,51 +218,193 @@ def build_indices(output_dir='build'):
         'all_pages': all_pages,
         'articles': articles,
         'by_url': by_url,
-        'by_category': by_category})
+        'by_category': by_category,
+        'index': PageIndex(all_pages, index_attrs),
+        'records': page_records})
+
+def update_indices(site, paths, output_dir='build'):
+    """Bring the indices computed by build_indices up to date after the
+    files at paths have been edited, added or removed. Only pages whose
+    headers changed are reindexed. Returns true if any page changed."""
+    all_pages = site['all_pages']
+    by_url = site['by_url']
+    by_category = site['by_category']
+    page_records = site['records']
+    old_pages = {p['ipath']: p for p in all_pages}
+    new_pages = []
+
+    def collect_page(context):
+        new_pages.append(context['attrs'])
+        return context
+
+    rule = [
+            is_html_src,
+            components.to_dependency_f(output_dir, '.html'),
+            components.read_attrs_f(page_records),
+            components.ispublished,
+            set_url,
+            collect_page,
+            utils.always(pl.COMPLETE)
+            ]
 
-def build_site(site, output_dir='build'):
-    """Build the site, source in src result in build."""
-    sources = utils.match_pats('src/**/', 'src/*', 'src/**/*')
+    categories = set()
+    changed = False
+    for path in paths:
+        path = Path(path)
+        if utils.is_hidden(path) or is_html_src(path) == pl.NOT_APPLICABLE:
+            continue
+        old_record = page_records.pop(path, None)
+        if path.is_file():
+            record = records.read_record(path)
+            page_records[path] = record
+            if old_record and old_record.header == record.header:
+                continue
+            pl.build([rule], path)
+        logging.info('Reindexing %s', path)
+        changed = True
+        old = old_pages.get(path, None)
+        if old:
+            all_pages[:] = [p for p in all_pages if p is not old]
+            if by_url.get(old['url'], None) is old:
+                del by_url[old['url']]
+            category = old.get('category', 'none')
+            by_category[category] = [p for p in by_category[category] if p is not old]
+            if not by_category[category]:
+                del by_category[category]
+            categories.add(category)
+
+    for attrs in new_pages:
+        all_pages.append(attrs)
+        by_url[attrs['url']] = attrs
+        category = attrs.get('category', 'none')
+        by_category.setdefault(category, []).append(attrs)
+        categories.add(category)
+
+    if changed:
+        sort_by(all_pages, 'date', EARLY, True)
+        site['articles'][:] = [p for p in all_pages if p.get('kind', '') == 'article']
+        for category in categories:
+            if category in by_category:
+                sort_by(by_category[category], 'date', EARLY, True)
+        site['index'].rebuild()
+    return changed
+
+def use_cache_dir(cache_dir):
+    """Keep the persistent build caches under cache_dir, None turns them off."""
+    if cache_dir:
+        Expander.template_cache.disk = DiskCache(Path(cache_dir, 'templates'))
+        converters.markdown_cache = DiskCache(
+                Path(cache_dir, 'markdown'), MARKDOWN_CACHE_BYTES)
+        converters.css_cache = DiskCache(Path(cache_dir, 'css'))
+    else:
+        Expander.template_cache.disk = None
+        converters.markdown_cache = None
+        converters.css_cache = None
+
+def load_dependency_graph(cache_dir):
+    """Load the dependency graph saved in cache_dir by the previous build."""
+    if not cache_dir:
+        return DependencyGraph()
+    return DependencyGraph(Path(cache_dir, 'dependencies.json')).load()
+
+def load_manifest(cache_dir):
+    """Load the build manifest saved in cache_dir by the previous build."""
+    if not cache_dir:
+        return BuildManifest()
+    return BuildManifest(Path(cache_dir, 'manifest.json')).load()
+
+def load_deploy_manifest(cache_dir):
+    """Load the deploy manifest saved in cache_dir by the previous build."""
+    if not cache_dir:
+        return deploy.DeployManifest()
+    return deploy.DeployManifest(Path(cache_dir, 'deploy.json')).load()
+
+def build_site(site, output_dir='build', cache_dir=CACHE_DIR, md_batch_size=1, jobs=1,
+        graph=None, manifest=None, paths=None, force=False, assets='copy', prune=False):
+    """Build the site, source in src result in build.
+
+    With md_batch_size > 1 markdown is converted md_batch_size documents
+    at a time and the affected pages are written once their batch is done.
+    With jobs > 1 the pages are built by that many worker processes.
+    A dependency graph and a build manifest that are already in memory
+    can be passed in instead of loading them from cache_dir, and paths
+    limits the build to those source files. With force everything is
+    rebuilt, whether it is out of date or not. Static files are copied
+    with the assets strategy, see qrn.assets.
+
+    After a successful build the files in output_dir, and what changed
+    since the previous build, are written to deploy.json in cache_dir.
+    Outputs whose sources have been deleted are reported and, with
+    prune, removed."""
+    start = time.perf_counter()
+    utils.update_log_level()
+    use_cache_dir(cache_dir)
+    Expander.fragment_cache = FragmentCache()
+    # Workers report what they do after the fork, so settle the counts so far.
+    Expander.template_cache.merge(Expander.template_cache.drain())
+    sass_batch = converters.SassBatch(converters.css_cache)
+    copier = AssetCopier(assets)
+    if md_batch_size > 1:
+        Expander.markdown_batch = converters.MarkdownBatch(md_batch_size)
+    if paths is None:
+        sources = utils.walk('src')
+    else:
+        sources = paths
     html_inc_files = utils.match_pats('src/_layouts/*', include_all=True)
-    css_inc_files = utils.match_pats('src/**/_*.scss', 'src/**/_*.css', include_all=True)
 
-    logging.debug('Sources: %s', sources)
+    # The sources are walked lazily, so they can't be listed up front.
     logging.debug('HTML INC: %s', html_inc_files)
-    logging.debug('CSS INC: %s', css_inc_files)
+
+    # Reuse the headers that build_indices already read.
+    read_attrs = components.read_attrs_f(site.get('records', None))
+
+    if graph is None:
+        graph = load_dependency_graph(cache_dir)
+    if manifest is None:
+        manifest = load_manifest(cache_dir)
+
+    html_isoutdated = isoutdated_f(graph, manifest)
+    isoutdated = components.isoutdated_f(manifest)
+    if force:
+        html_isoutdated = isoutdated = components.outdated
 
     html_rule = [
             is_html_src,
-            components.to_dependency_f(output_dir, '.html', html_inc_files),
-            components.isoutdated,
-            components.read_attrs,
+            components.to_dependency_f(output_dir, '.html', html_inc_files, graph),
+            read_attrs,
             components.ispublished,
-            components.print_path_f("Building from HTML"),
             set_url,
             insert_attr_f('attrs', 'site', site),
+            html_isoutdated,
+            components.print_path_f("Building from HTML"),
             build_html,
             debug_f('Writing html'),
-            write_text,
+            write_text_f(manifest),
+            components.record_dependencies_f(graph),
+            components.record_build_f(manifest),
             utils.always(pl.COMPLETE)
             ]
 
     xml_rule = [
             components.is_suffix_f('.xml'),
             components.to_dependency_f(output_dir),
-            components.read_attrs,
+            read_attrs,
             components.print_path_f("Building from XML"),
             insert_attr_f('attrs', 'site', site),
             set_url,
             build_xml,
-            write_text,
+            write_text_f(manifest),
             utils.always(pl.COMPLETE)
             ]
 
     css_rule = [
             components.is_suffix_f('.sass', '.scss'),
-            components.to_dependency_f(output_dir, '.css', css_inc_files),
-            components.isoutdated,
+            components.to_dependency_f(output_dir, '.css'),
+            find_sass_dependencies,
+            isoutdated,
             components.print_path_f("Building SASS/SCSS"),
-            build_css,
+            build_css_f(sass_batch),
+            components.record_build_f(manifest),
             utils.always(pl.COMPLETE)
             ]
 
@@ -197,13 +417,73 @@ def build_site(site, output_dir='build'):
 
     copy_rule = [
             components.to_dependency_f(output_dir),
-            components.isoutdated,
+            isoutdated,
             components.print_path_f("Copying"),
             debug_f('Copy file'),
-            components.copy_file,
+            components.copy_file_f(copier),
+            components.record_build_f(manifest),
             utils.always(pl.COMPLETE)]
 
     rules = [xml_rule, html_rule, css_rule, dir_rule, copy_rule]
 
     print('build....')
-    return pl.build_all(rules, sources)
+    built = []
+
+    def finish():
+        if Expander.markdown_batch:
+            Expander.markdown_batch.flush()
+        sass_batch.flush()
+        timings = timing.timings.drain() if timing.timings else []
+        caches = Expander.template_cache.drain(), Expander.fragment_cache.drain()
+        return graph.drain(), manifest.drain(), timings, copier.drain(), caches
+
+    def merge(finished):
+        graph.merge(finished[0])
+        manifest.merge(finished[1])
+        built.extend(finished[1]['outputs'])
+        if timing.timings:
+            timing.timings.merge(finished[2])
+        copier.merge(finished[3])
+        Expander.template_cache.merge(finished[4][0])
+        Expander.fragment_cache.merge(finished[4][1])
+
+    result = False
+    try:
+        if jobs > 1:
+            # The directories have to exist before the workers write to them.
+            sources = list(sources)
+            pl.build_all([dir_rule, [utils.always(pl.COMPLETE)]], sources)
+        result = pl.build_all(rules, sources, jobs, finish, merge)
+        if result:
+            deploy_manifest = update_deploy_manifest(
+                    output_dir, cache_dir, graph, manifest, prune)
+    finally:
+        Expander.markdown_batch = None
+        fragment_stats = Expander.fragment_cache.stats()
+        Expander.fragment_cache = None
+        if not result:
+            manifest.abandon()
+        graph.save()
+        manifest.save()
+    summary.info('Build %s: %d files rebuilt in %.2fs.',
+            'done' if result else 'failed', len(built), time.perf_counter() - start)
+    summary.info('Template cache: %s', Expander.template_cache.stats())
+    summary.info('Fragment cache: %s', fragment_stats)
+    summary.info('Assets: %s', copier.stats())
+    if result:
+        summary.info('Deploy: %s', deploy_manifest.stats())
+    return result
+
+def update_deploy_manifest(output_dir, cache_dir, graph, manifest, prune=False):
+    """Find the orphaned outputs, pruning them if asked, then record the
+    files in output_dir and what changed since the previous build."""
+    orphans = deploy.find_orphans(output_dir, manifest)
+    if prune:
+        deploy.prune(orphans, manifest, graph)
+        orphans = [p for p in orphans if p.exists()]
+    for path in orphans:
+        logging.warning('Orphaned output, its source is gone: %s', path)
+    deploy_manifest = load_deploy_manifest(cache_dir)
+    deploy_manifest.update(output_dir, manifest, orphans)
+    deploy_manifest.save()
+    return deploy_manifest
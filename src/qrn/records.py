@@ -0,0 +1,58 @@
+'''Page records: what indexing learned about each source file.'''
+
+import hashlib
+import json
+import os
+import qrn.utils as utils
+
+class PageRecord:
+    '''The header of a source file along with where its body starts.'''
+
+    def __init__(self, path, header, offset, mtime, size):
+        self.path = path
+        self.header = header
+        self.offset = offset
+        self.mtime = mtime
+        self.size = size
+        self.__digest = None
+
+    def is_current(self):
+        '''Return true if the file hasn't changed since it was read.'''
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return st.st_mtime == self.mtime and st.st_size == self.size
+
+    def header_digest(self):
+        '''Return a hash of the header contents.'''
+        if not self.__digest:
+            self.__digest = digest(self.header)
+        return self.__digest
+
+    def read_body(self):
+        '''Read the body of the file, skipping the header.'''
+        return utils.read_body_at(self.path, self.offset)
+
+    def __repr__(self):
+        return f'<<PageRecord: {self.path}>>'
+
+def digest(value):
+    '''Return the sha256 of a json rendering of value.'''
+    text = json.dumps(value, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def read_record(path):
+    '''Read the header of the file at path into a new PageRecord.'''
+    st = os.stat(path)
+    header, offset = utils.read_header_offset(path)
+    return PageRecord(path, header, offset, st.st_mtime, st.st_size)
+
+def current_record(records, path):
+    '''Return the record for path if there is one and it is still current.'''
+    if not records:
+        return None
+    record = records.get(path, None)
+    if record and record.is_current():
+        return record
+    return None
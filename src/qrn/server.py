@@ -0,0 +1,196 @@
+'''Development server: renders the pages of a site on demand, from memory.'''
+
+import http.server
+import logging
+import mimetypes
+import os
+import tempfile
+import time
+import traceback
+import urllib.parse
+from pathlib import Path
+import qrn.components as components
+import qrn.converters as converters
+import qrn.pipeline as pl
+import qrn.qrn as qrn
+import qrn.utils as utils
+import qrn.watch as watch
+
+def build_css_text(context):
+    '''Pipeline function that converts sass/scss into css in the context.'''
+    ipath = context['sources'][0]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        opath = Path(tmp_dir, context['output'].name)
+        converters.sass_to_css(ipath, opath)
+        context['text'] = utils.read_file(opath)
+    context['dependencies'] = converters.sass_dependencies(ipath)
+    return context
+
+def content_type(path):
+    '''Return the Content-Type to serve the file at path with.'''
+    ctype = mimetypes.guess_type(str(path))[0] or 'application/octet-stream'
+    if ctype.startswith('text/') or ctype.endswith(('xml', 'javascript', 'json')):
+        ctype += '; charset=utf-8'
+    return ctype
+
+class SiteRenderer:
+    '''Maps urls back to the source files they are built from and renders
+    them the first time they are asked for.
+
+    Rendered pages are kept in memory along with the files and the index
+    queries that went into them. Every poll_interval seconds src is checked
+    for changes, the site index is updated and the pages made from changed
+    files are forgotten. Static files are not rendered or cached, they are
+    served straight from src.'''
+
+    def __init__(self, site, output_dir='build', poll_interval=0.5):
+        self.site = site
+        self.output_dir = output_dir
+        self.poll_interval = poll_interval
+        self.pages = {}
+        self.files = watch.snapshot()
+        self.checked = time.monotonic()
+        read_attrs = components.read_attrs_f(site['records'])
+        insert_site = qrn.insert_attr_f('attrs', 'site', site)
+
+        def keep(context):
+            self.context = context
+            return pl.COMPLETE
+
+        self.rules = [
+                [
+                    components.is_suffix_f('.xml'),
+                    components.to_dependency_f(output_dir),
+                    read_attrs,
+                    insert_site,
+                    qrn.set_url,
+                    qrn.build_xml,
+                    keep],
+                [
+                    qrn.is_html_src,
+                    components.to_dependency_f(output_dir, '.html'),
+                    read_attrs,
+                    components.ispublished,
+                    qrn.set_url,
+                    insert_site,
+                    qrn.build_html,
+                    keep],
+                [
+                    components.is_suffix_f('.sass', '.scss'),
+                    components.to_dependency_f(output_dir, '.css'),
+                    build_css_text,
+                    keep],
+                [
+                    components.to_dependency_f(output_dir),
+                    keep]]
+
+    def refresh(self):
+        '''Forget the pages affected by changes to the files under src.'''
+        now = time.monotonic()
+        if now - self.checked < self.poll_interval:
+            return
+        files = watch.snapshot()
+        changed = watch.changed_paths(self.files, files)
+        self.files = files
+        self.checked = now
+        if not changed:
+            return
+        logging.info('Changed: %s', changed)
+        index_changed = qrn.update_indices(self.site, changed, self.output_dir)
+        changed = set(str(p) for p in changed)
+        for url, page in list(self.pages.items()):
+            if changed.intersection(page['sources']) or (index_changed and page['queries']):
+                logging.info('Forgetting %s', url)
+                del self.pages[url]
+
+    def source_for(self, url):
+        '''Return the source file that url is built from, or None.'''
+        page = self.site['by_url'].get(url, None)
+        if page:
+            return Path(page['ipath'])
+        relative = Path(url.lstrip('/'))
+        if any(part == '..' or part.startswith(('.', '_')) for part in relative.parts):
+            return None
+        candidates = components.possible_sources(relative)
+        return next((p for p in candidates if p.is_file()), None)
+
+    def render(self, url):
+        '''Return a dictionary describing what to serve for url, or None.
+        Rendered pages have a body, static files a path to send.'''
+        self.refresh()
+        page = self.pages.get(url, None)
+        if page:
+            return page
+        path = self.source_for(url)
+        if not path:
+            return None
+        self.context = None
+        pl.build(self.rules, path)
+        context = self.context
+        self.context = None
+        if not context:
+            return None
+        if 'text' not in context:
+            return {'path': path, 'type': content_type(path)}
+        logging.info('Rendered %s from %s', url, path)
+        sources = [path] + list(context.get('dependencies', []))
+        page = {
+                'body': context['text'].encode('utf-8'),
+                'type': content_type(context['output']),
+                'sources': set(str(s) for s in sources),
+                'queries': context.get('queries', [])}
+        self.pages[url] = page
+        return page
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    '''Serves the pages from the SiteRenderer attached to the server.'''
+
+    def do_GET(self):
+        self.__respond(True)
+
+    def do_HEAD(self):
+        self.__respond(False)
+
+    def __respond(self, send_body):
+        url = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if url.endswith('/'):
+            url += 'index.html'
+        try:
+            page = self.server.renderer.render(url)
+        except Exception as e:
+            logging.exception('Failed to render %s', url)
+            self.send_error(500, f'Failed to render {url}: {e}', traceback.format_exc())
+            return
+        if not page:
+            self.send_error(404, f'Nothing in src for {url}')
+            return
+        if 'body' in page:
+            self.__send_headers(page['type'], len(page['body']))
+            if send_body:
+                self.wfile.write(page['body'])
+            return
+        with open(page['path'], 'rb') as f:
+            self.__send_headers(page['type'], os.fstat(f.fileno()).st_size)
+            if send_body:
+                self.wfile.flush()
+                self.connection.sendfile(f)
+
+    def __send_headers(self, ctype, length):
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+def serve(site, host='localhost', port=8000, output_dir='build', cache_dir=qrn.CACHE_DIR):
+    '''Serve the site, rendering each page when it is first asked for.'''
+    qrn.use_cache_dir(cache_dir)
+    server = http.server.HTTPServer((host, port), RequestHandler)
+    server.renderer = SiteRenderer(site, output_dir)
+    print(f'Serving src on http://{host}:{port}/, ^C to stop.')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
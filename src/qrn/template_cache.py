@@ -0,0 +1,112 @@
+'''Cache of compiled template code, shared by all of the pages in a build.'''
+
+import hashlib
+import importlib.util
+import logging
+import marshal
+import qrn
+import qrn.epy as epy
+import qrn.paml as paml
+import qrn.timing as timing
+from qrn.code_generator import CODE_FORMAT
+
+COMPILERS = {
+        'epy': epy.template_from_text,
+        'paml': paml.template_from_text}
+
+# Marshalled code is only good for the same QRN, the same kind of
+# generated code and the same Python.
+STAMP = f'{qrn.__version__} {CODE_FORMAT} {importlib.util.MAGIC_NUMBER.hex()}'
+
+def content_hash(text):
+    '''Return the hex sha256 of some template text.'''
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+class TemplateCache:
+    '''Compiled template code keyed by path, template kind and content hash.
+
+    Only the most recent version of each (path, kind) is kept, so an edited
+    template simply replaces its old entry. If disk is set to a DiskCache
+    the marshalled code is also saved there and reused by later builds.'''
+
+    def __init__(self, disk=None):
+        self.disk = disk
+        self.clear()
+
+    def clear(self):
+        '''Drop all of the in memory code and reset the counters.'''
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.drained_entries = 0
+        self.totals = {'hits': 0, 'loads': 0, 'misses': 0, 'entries': 0}
+
+    def compile(self, path, text, kind):
+        '''Return the compiled code for the template text, compiling if need be.'''
+        digest = content_hash(text)
+        key = (str(path), kind)
+        entry = self.entries.get(key, None)
+        if entry and entry[0] == digest:
+            self.hits += 1
+            return entry[1]
+        code = self._load(key, digest)
+        if code:
+            self.loads += 1
+        else:
+            self.misses += 1
+            logging.debug('Template cache miss: %s (%s)', path, kind)
+            with timing.stage('compile', path):
+                code = COMPILERS[kind](text, path)
+            self._save(key, digest, code)
+        self.entries[key] = (digest, code)
+        return code
+
+    def _disk_key(self, key):
+        return f'template:{key[1]}:{key[0]}'
+
+    def _load(self, key, digest):
+        if not self.disk:
+            return None
+        data = self.disk.get(self._disk_key(key))
+        if not data:
+            return None
+        header, _, body = data.partition(b'\n')
+        if header.decode('utf-8') != f'{STAMP} {digest}':
+            return None
+        try:
+            return marshal.loads(body)
+        except (EOFError, ValueError, TypeError):
+            logging.warning('Bad template cache entry for %s', key[0])
+            return None
+
+    def _save(self, key, digest, code):
+        if not self.disk:
+            return
+        header = f'{STAMP} {digest}\n'.encode('utf-8')
+        self.disk.put(self._disk_key(key), header + marshal.dumps(code))
+
+    def drain(self):
+        '''Return and forget the counts since the last drain. Used to carry
+        the counts of worker processes back to the parent.'''
+        counts = {
+                'hits': self.hits,
+                'loads': self.loads,
+                'misses': self.misses,
+                'entries': len(self.entries) - self.drained_entries}
+        self.hits = self.loads = self.misses = 0
+        self.drained_entries = len(self.entries)
+        return counts
+
+    def merge(self, counts):
+        '''Add counts returned by drain.'''
+        for k, v in counts.items():
+            self.totals[k] += v
+
+    def stats(self):
+        '''Return a dictionary of the cache counters.'''
+        return {
+                'hits': self.totals['hits'] + self.hits,
+                'loads': self.totals['loads'] + self.loads,
+                'misses': self.totals['misses'] + self.misses,
+                'entries': self.totals['entries'] + len(self.entries) - self.drained_entries}
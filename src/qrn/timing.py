@@ -0,0 +1,129 @@
+'''Build profiling: how long each pipeline step and each file takes.'''
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+class Timings:
+    '''A list of timed events. Steps are the pipeline functions run for
+    a source file, stages are the interesting work (pandoc, sass, ...)
+    done inside of them.'''
+
+    def __init__(self):
+        self.events = []
+        self.pending = []
+
+    def add(self, kind, name, source, start, end):
+        event = {
+                'kind': kind,
+                'name': name,
+                'source': str(source) if source else None,
+                'start': start,
+                'duration': end - start,
+                'pid': os.getpid()}
+        self.events.append(event)
+        self.pending.append(event)
+
+    def drain(self):
+        '''Return and forget the events added since the last drain.'''
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def merge(self, events):
+        '''Add the events drained from a worker process. Events from this
+        process are already here.'''
+        pid = os.getpid()
+        self.events += [e for e in events if e['pid'] != pid]
+
+    def totals(self, field, kind=None):
+        '''Return [name, count, total seconds] for each value of field,
+        slowest first.'''
+        totals = {}
+        for e in self.events:
+            if kind and e['kind'] != kind:
+                continue
+            key = e[field]
+            if key is None:
+                continue
+            count, seconds = totals.get(key, (0, 0.0))
+            totals[key] = (count + 1, seconds + e['duration'])
+        result = [[k, c, s] for k, (c, s) in totals.items()]
+        result.sort(key=lambda r: r[2], reverse=True)
+        return result
+
+    def report(self, n=20):
+        '''Return a readable summary of the slowest steps, stages and files.'''
+        lines = []
+        for title, field, kind in [
+                ('Time by step', 'name', 'step'),
+                ('Time by stage', 'name', 'stage'),
+                ('Slowest files', 'source', 'step')]:
+            lines.append(f'{title}:')
+            for name, count, seconds in self.totals(field, kind)[:n]:
+                lines.append(f'  {seconds:10.3f}s {count:6d}  {name}')
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        '''Write the events and the totals out as json.'''
+        data = {
+                'steps': self.totals('name', 'step'),
+                'stages': self.totals('name', 'stage'),
+                'files': self.totals('source', 'step'),
+                'events': self.events}
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+
+    def write_chrome_trace(self, path):
+        '''Write the events in the Chrome trace format, for chrome://tracing
+        or https://ui.perfetto.dev.'''
+        trace = []
+        for e in self.events:
+            trace.append({
+                'name': e['name'],
+                'cat': e['kind'],
+                'ph': 'X',
+                'ts': e['start'] * 1e6,
+                'dur': e['duration'] * 1e6,
+                'pid': e['pid'],
+                'tid': e['pid'],
+                'args': {'source': e['source']}})
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': trace}, f)
+
+# The timings being collected, None when profiling is off.
+timings = None
+
+def enable():
+    '''Start collecting timings.'''
+    global timings
+    timings = Timings()
+    return timings
+
+def disable():
+    '''Stop collecting timings, returning what was collected.'''
+    global timings
+    result = timings
+    timings = None
+    return result
+
+@contextmanager
+def stage(name, source=None):
+    '''Time the enclosed block as a stage, if profiling is on.'''
+    if not timings:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add('stage', name, source, start, time.perf_counter())
+
+def timed_step(f, context, source):
+    '''Call the pipeline function f, timing it as a step.'''
+    start = time.perf_counter()
+    try:
+        return f(context)
+    finally:
+        timings.add('step', f.__name__.lstrip('_'), source, start, time.perf_counter())
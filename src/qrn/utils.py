@@ -2,6 +2,7 @@ import datetime
 import email.utils
 import fnmatch
 import glob
+import hashlib
 import logging
 import os
 import os.path
@@ -13,8 +14,6 @@ import time
 import yaml
 import shutil
 from pathlib import Path
-from io import StringIO
-from contextlib import redirect_stdout
 
 PPrinter = pprint.PrettyPrinter(indent=4)
 pp = PPrinter.pprint
@@ -56,18 +55,58 @@ class EasyDict(dict):
 
 MarkerRE = r'^--- *$'
 
+# True when debug logging is on. Code that runs for every token, node or
+# file checks this rather than calling logging.debug, which would have
+# to look up the logging level each time. Entry points like build_site
+# call update_log_level to refresh it.
+DEBUG = False
+
+def update_log_level():
+    """Recheck whether debug logging is on, returning the result."""
+    global DEBUG
+    DEBUG = logging.getLogger().isEnabledFor(logging.DEBUG)
+    return DEBUG
+
 def read_file(path, mode='r'):
-    logging.debug(f'Read file: %s', path)
+    if DEBUG:
+        logging.debug('Read file: %s', path)
     result = None
     with open(path, mode) as f:
         result = f.read()
     return result
 
-def write_file(contents, path, mode='w'):
-    logging.debug('Write file: %s', path)
-    result = None
-    with open(path, mode) as f:
-        f.write(contents)
+def write_file(contents, path, mode='w', compare=False, current_hash=None):
+    """Write contents to path. The contents go to a temporary file that is
+    renamed over path, so nothing ever sees a half written file.
+
+    With compare, path is left alone if it already holds the same contents.
+    If current_hash is supplied it is taken to be the sha256 of what is in
+    path now, which saves reading it. Returns true if path was written."""
+    if DEBUG:
+        logging.debug('Write file: %s', path)
+    if compare and __same_contents(contents, path, mode, current_hash):
+        logging.info('Unchanged: %s', path)
+        return False
+    path = Path(path)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with open(tmp_path, mode) as f:
+            f.write(contents)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+def __same_contents(contents, path, mode, current_hash):
+    data = contents if 'b' in mode else contents.encode('utf-8')
+    if current_hash is not None:
+        return hashlib.sha256(data).hexdigest() == current_hash
+    try:
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except FileNotFoundError:
+        return False
 
 def __read_until_match(f, regex):
     line = f.readline()
@@ -114,10 +153,26 @@ def read_header_f(f):
 
 def read_header(path):
     """Read the header of a file."""
-    logging.debug('Read header: %s', path)
+    if DEBUG:
+        logging.debug('Read header: %s', path)
     with open(path) as f:
         return read_header_f(f)
 
+def read_header_offset(path):
+    """Read the header of a file, returning the header and the
+    offset of the start of the body."""
+    if DEBUG:
+        logging.debug('Read header: %s', path)
+    with open(path) as f:
+        header = read_header_f(f)
+        return header, f.tell()
+
+def read_body_at(path, offset):
+    """Read the body of a file, given the offset from read_header_offset."""
+    with open(path) as f:
+        f.seek(offset)
+        return f.read()
+
 def read_body(path):
     """Given a path, read the body (i.e. w/o the header) of the file.
     Will return the entire file if there is no header."""
@@ -147,20 +202,51 @@ def write_structured_f(header, body, f):
         f.write("---\n")
     f.write(body)
 
+def is_hidden(path):
+    """Return true if any part of the path starts with _."""
+    return any(part.startswith('_') for part in Path(path).parts)
+
 def match_pat(pat, include_all=False):
     """Given a glob pat, return matching files. If include_all is False,
     skip files that start with _."""
-    spaths = glob.glob(pat, recursive=True)
+    paths = [Path(p) for p in glob.glob(pat, recursive=True)]
     if include_all:
-        return [Path(p) for p in spaths]
-    paths = [Path(p) for p in spaths if not re.search('/_', p)]
-    return paths
+        return paths
+    return [p for p in paths if not is_hidden(p)]
 
 def match_pats(*pats, include_all=False):
-    results = []
+    """Return the files matching any of the glob pats, each only once."""
+    results = {}
     for p in pats:
-        results += match_pat(p, include_all)
-    return results
+        for path in match_pat(p, include_all):
+            results[path] = True
+    return list(results)
+
+def walk(root, include_all=False):
+    """Lazily yield root and everything under it, each path once.
+
+    A directory always comes before its contents, and within a directory
+    the subdirectories come before the files, all sorted by name. Like
+    glob, skips names starting with a dot. If include_all is False, also
+    skips names that start with _ without descending into them."""
+    root = Path(root)
+    yield root
+    dirs = []
+    files = []
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            if entry.name.startswith('_') and not include_all:
+                continue
+            if entry.is_dir():
+                dirs.append(entry.name)
+            else:
+                files.append(entry.name)
+    for name in sorted(dirs):
+        yield from walk(Path(root, name), include_all)
+    for name in sorted(files):
+        yield Path(root, name)
 
 def relocate(path, new_dir, suffix=None):
     """Given a path and a directory, replace the leading dir of the path
@@ -214,6 +300,8 @@ def memoize(f):
 
 def log_code(code_str):
     """Given code in a string, log it out line by line."""
+    if not DEBUG:
+        return
     logging.debug('---- Code ----')
     lines = code_str.split('\n')
     for i in range(len(lines)):
@@ -229,21 +317,37 @@ def compile_string(s, desc):
     result = compile(s, desc, "exec")
     return result
 
-def exec_prog_output(compiled, glob={}, loc={}):
-    """Execute the code supplied, returning it's stdout contents."""
-    f = StringIO()
+# Generated template code appends its output to a list with this name.
+OUTPUT_NAME = '_qrn_out'
+
+def exec_prog_output(compiled, glob={}, loc=None):
+    """Execute the template code supplied, returning it's output.
+
+    The code appends its output to a list in loc, also visible in glob
+    for functions the code defines. Code that calls print
+    gets a version that prints to the same list, as if stdout had
+    been redirected."""
+    output = []
+    def _print(*args, sep=' ', end='\n', file=None, flush=False):
+        if file is not None:
+            print(*args, sep=sep, end=end, file=file, flush=flush)
+        else:
+            output.append(sep.join(str(a) for a in args) + end)
+    glob = dict(glob)
+    glob['print'] = _print
+    glob[OUTPUT_NAME] = output
+    if loc is None:
+        loc = {}
+    loc[OUTPUT_NAME] = output
+    loc['print'] = _print
     try:
-        with redirect_stdout(f):
-            exec(compiled, glob, loc)
+        exec(compiled, glob, loc)
     except Exception as e:
         logging.warning("Error running code %s", e)
         raise e
-    f.seek(0)
-    result = f.read()
-    f.close()
-    return result
+    return ''.join(output)
 
-def exec_string_output(s, glob={}, loc={}, desc="Dynamically generated"):
+def exec_string_output(s, glob={}, loc=None, desc="Dynamically generated"):
     """Execute the string supplied as code, returning it's stdout contents."""
     compiled = compile_string(s)
     return exec_prog_output(compiled, glob, loc, desc)
@@ -0,0 +1,111 @@
+'''Watch mode: keep a built site in memory and rebuild what changes.'''
+
+import logging
+import os
+import time
+import qrn.qrn as qrn
+import qrn.utils as utils
+
+def snapshot(root='src'):
+    '''Return a dictionary of path => (mtime, size) for root and
+    everything under it, including the files that start with _.'''
+    result = {}
+    for path in utils.walk(root, include_all=True):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        result[path] = (st.st_mtime_ns, st.st_size)
+    return result
+
+def changed_paths(old, new):
+    '''Return the paths that were edited, added or removed between two snapshots.'''
+    paths = [p for p, stamp in new.items() if old.get(p, None) != stamp]
+    paths += [p for p in old if p not in new]
+    return paths
+
+class Watcher:
+    '''Rebuilds a site as its source files change.
+
+    The site index, the compiled templates, the dependency graph and the
+    build manifest all stay in memory between rebuilds. On a change only
+    the changed headers are reread and only the outputs that were built
+    from a changed file, or whose index queries may now give a different
+    answer, are considered for rebuilding.'''
+
+    def __init__(self, site, output_dir='build', cache_dir=qrn.CACHE_DIR, md_batch_size=1, jobs=1,
+            assets='copy'):
+        self.site = site
+        self.output_dir = output_dir
+        self.cache_dir = cache_dir
+        self.md_batch_size = md_batch_size
+        self.jobs = jobs
+        self.assets = assets
+        self.graph = qrn.load_dependency_graph(cache_dir)
+        self.manifest = qrn.load_manifest(cache_dir)
+        self.files = {}
+
+    def build(self, paths=None):
+        '''Build the site, or just the source files at paths.'''
+        return qrn.build_site(
+                self.site, self.output_dir, self.cache_dir, self.md_batch_size, self.jobs,
+                graph=self.graph, manifest=self.manifest, paths=paths, assets=self.assets)
+
+    def affected(self, changed, index_changed):
+        '''Return the source files that might need rebuilding after the
+        changed files changed, in the order a full build would visit them.'''
+        changed = set(str(p) for p in changed)
+        result = set()
+        recorded = set()
+        for output, entry in self.manifest.outputs.items():
+            source = entry.get('source', None)
+            if not source:
+                continue
+            recorded.add(source)
+            if changed.intersection(entry['sources']):
+                result.add(source)
+            elif index_changed and self.graph.queries_for(output):
+                result.add(source)
+        # Anything the manifest doesn't know about is always built.
+        for path in self.files:
+            if str(path) in changed or str(path) not in recorded:
+                result.add(str(path))
+        return [p for p in self.files if str(p) in result and not utils.is_hidden(p)]
+
+    def check(self):
+        '''Look for changes and rebuild if there are any, returning the changed files.'''
+        files = snapshot()
+        changed = changed_paths(self.files, files)
+        if not changed:
+            return changed
+        self.files = files
+        start = time.perf_counter()
+        logging.info('Changed: %s', changed)
+        index_changed = qrn.update_indices(self.site, changed, self.output_dir)
+        paths = self.affected(changed, index_changed)
+        logging.info('Rebuilding %d of %d files.', len(paths), len(files))
+        self.build(paths)
+        print(f'Checked {len(paths)} files in {time.perf_counter() - start:.3f}s')
+        return changed
+
+    def run(self, interval=0.5):
+        '''Build the site and then keep rebuilding it until interrupted.'''
+        self.files = snapshot()
+        self.build()
+        print('Watching src for changes, ^C to stop.')
+        try:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check()
+                except Exception as e:
+                    logging.exception('Rebuild failed')
+                    print('Rebuild failed:', e)
+        except KeyboardInterrupt:
+            pass
+
+def watch(site, output_dir='build', cache_dir=qrn.CACHE_DIR, md_batch_size=1, jobs=1,
+        interval=0.5, assets='copy'):
+    '''Build the site and rebuild it whenever a file under src changes.'''
+    watcher = Watcher(site, output_dir, cache_dir, md_batch_size, jobs, assets)
+    watcher.run(interval)
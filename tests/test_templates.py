@@ -0,0 +1,21 @@
+'''Rendering of template expressions by the epy and paml compilers.'''
+
+import qrn.epy as epy
+import qrn.paml as paml
+import qrn.utils as utils
+
+def render(code, **env):
+    return utils.exec_prog_output(code, loc=env)
+
+def test_epy_expression():
+    assert render(epy.template_from_text('x=<%= a %>.'), a=1) == 'x=1.'
+
+def test_epy_comma_expression_joins_with_spaces():
+    assert render(epy.template_from_text('<%= a, b %>'), a=1, b=2) == '1 2'
+
+def test_epy_tuple_value():
+    assert render(epy.template_from_text('<%= t %>'), t=(1, 2)) == '(1, 2)'
+
+def test_paml_comma_expression_joins_with_spaces():
+    code = paml.template_from_text('%p= a, b\n')
+    assert render(code, a=1, b=2).strip() == '<p>1 2</p>'